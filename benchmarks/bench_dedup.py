@@ -0,0 +1,51 @@
+# DedupIndex на 1M ссылок: память, прогрев из базы, одиночная и пакетная проверка.
+#   python benchmarks/bench_dedup.py [число ссылок]
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.harness import load_bot
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    bot = load_bot()
+    logging.disable(logging.CRITICAL)
+    links = [f"https://example{n % 50}.com/news/{n}/some-article-slug" for n in range(count)]
+
+    index = bot.DedupIndex()
+    started = time.perf_counter()
+    for link in links:
+        index.add(link)
+    build = time.perf_counter() - started
+    # Хэш-таблица множества плюс сами int-ключи
+    memory = (sys.getsizeof(index._keys) + sum(sys.getsizeof(key) for key in index._keys)) / 2**20
+    print(f"build {count} links        {build:6.2f} s, {memory:.0f} MB")
+
+    queries = links[::100] + [link + "-new" for link in links[::100]]
+    started = time.perf_counter()
+    for link in queries:
+        link in index
+    print(f"single lookup             {(time.perf_counter() - started) / len(queries) * 1e6:6.2f} us")
+    started = time.perf_counter()
+    index.find_duplicates(queries)
+    print(f"batch lookup              {(time.perf_counter() - started) / len(queries) * 1e6:6.2f} us per link")
+
+    with bot.db_transaction() as c:
+        c.executemany("INSERT OR IGNORE INTO seen_links (key) VALUES (?)", ((bot.DedupIndex.key_for_link(link),) for link in links))
+    started = time.perf_counter()
+    bot.dedup_index.warm()
+    print(f"warm from seen_links      {time.perf_counter() - started:6.2f} s, {len(bot.dedup_index)} keys")
+    started = time.perf_counter()
+    for link in queries:
+        bot.check_duplicate(link)
+    print(f"check_duplicate           {(time.perf_counter() - started) / len(queries) * 1e6:6.2f} us")
+    started = time.perf_counter()
+    bot.check_duplicates(queries)
+    print(f"check_duplicates          {(time.perf_counter() - started) / len(queries) * 1e6:6.2f} us per link")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+# Время маршрутизации одного апдейта: dispatch_command и полный handle_update.
+# Telegram не вызывается, логирование выключено.
+#   python benchmarks/bench_dispatch.py [число апдейтов]
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.harness import load_bot
+
+TEXTS = ["/help", "/unknown", "/setinterval", "/help@AutoNewsBot", "/xxx"]
+
+
+def update(text):
+    return {"update_id": 1, "message": {"message_id": 1, "chat": {"id": 5}, "from": {"username": "alice"}, "text": text}}
+
+
+def per_call_us(func, arg, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        func(arg)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    bot = load_bot()
+    logging.disable(logging.CRITICAL)
+    bot.save_channel("-1001", "alice")
+    bot.send_message = lambda *args, **kwargs: True
+    print(f"get_channel_by_admin  {per_call_us(bot.get_channel_by_admin, 'alice', count):7.2f} us")
+    for text in TEXTS:
+        ctx = {"chat_id": 5, "text": text, "username": "alice", "message": {}, "channel": "-1001"}
+        dispatch = per_call_us(bot.dispatch_command, ctx, count)
+        handle = per_call_us(bot.handle_update, update(text), count)
+        print(f"{text:20}  dispatch {dispatch:6.2f} us  handle_update {handle:6.2f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# Извлечение текста статьи на сохранённых страницах, без сети.
+# По умолчанию корпус — tests/fixtures/html; можно указать свой каталог с .html.
+# Дополнительно: загрузка с локального сервера и повторный запрос из кэша статей.
+#   python benchmarks/bench_extract.py [каталог] [повторов]
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from tests.harness import load_bot
+
+FIXTURES = os.path.join(ROOT, "tests", "fixtures", "html")
+
+
+def load_corpus(directory):
+    pages = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith((".html", ".htm")):
+            with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                pages[name] = f.read()
+    return pages
+
+
+def serve(pages):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def setup(self):
+            super().setup()
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def do_GET(self):
+            data = pages[self.path.lstrip("/")].encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    directory = sys.argv[1] if len(sys.argv) > 1 else FIXTURES
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    bot = load_bot()
+    logging.disable(logging.CRITICAL)
+    pages = load_corpus(directory)
+    size = sum(len(page.encode()) for page in pages.values())
+
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages.values():
+            bot.extract_article_text(page)
+    elapsed = time.perf_counter() - started
+    full = [len(bot.extract_article_text(page, max_chars=10**9)) for page in pages.values()]
+    budget = [len(bot.extract_article_text(page)) for page in pages.values()]
+    print(f"{len(pages)} pages, {size / 2**20:.2f} MB")
+    print(f"extract          {elapsed / repeat / len(pages) * 1000:7.2f} ms/page  {size * repeat / elapsed / 2**20:6.1f} MB/s")
+    print(f"text             {sum(full) / len(full):7.0f} chars avg, {sum(budget) / len(budget):.0f} after budget")
+
+    server = serve(pages)
+    base = f"http://127.0.0.1:{server.server_address[1]}/"
+    bot.article_cache.clear()
+    started = time.perf_counter()
+    for name in pages:
+        bot.fetch_article_text(base + name)
+    fetch = (time.perf_counter() - started) / len(pages)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for name in pages:
+            bot.fetch_article_text(base + name)
+    cached = (time.perf_counter() - started) / repeat / len(pages)
+    print(f"fetch + extract  {fetch * 1000:7.2f} ms/page")
+    print(f"cached lookup    {cached * 1e6:7.1f} us/page")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# Рассылка одного поста в 100 каналов через локальный MockBotAPI.
+# Сравнивает последовательную отправку с пулом FANOUT_WORKERS и разными глобальными лимитами.
+#   python benchmarks/bench_fanout.py [каналов] [задержка ответа API, мс]
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.harness import load_bot
+from tests.mock_telegram import MockBotAPI
+
+CONFIGS = [
+    ("serial (1 worker)", 1, 30),
+    ("16 workers, 30 msg/s", 16, 30),
+    ("16 workers, 1000 msg/s", 16, 1000),
+]
+
+
+def main():
+    channels = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.04
+    mock = MockBotAPI(latency=latency).start()
+    bot = load_bot(TELEGRAM_API_BASE=mock.base_url, TELEGRAM_TOKEN=mock.token)
+    logging.disable(logging.CRITICAL)
+    channel_ids = [f"-100{n}" for n in range(channels)]
+    for channel_id in channel_ids:
+        bot.can_post_to_channel(channel_id)
+    for label, workers, global_rate in CONFIGS:
+        bot.fanout_executor = ThreadPoolExecutor(max_workers=workers)
+        bot.tg_global_bucket = bot.TokenBucket(global_rate, global_rate)
+        bot.tg_chat_buckets.clear()
+        item = {"link": f"https://example.com/{workers}-{global_rate}", "title": "Заголовок", "summary": "Пересказ",
+                "source": "example.com", "text": f"story {workers} {global_rate}", "delivered": {}, "posted": False}
+        started = time.perf_counter()
+        statuses = bot.deliver_post(item, channel_ids)
+        elapsed = time.perf_counter() - started
+        sent = sum(1 for status in statuses.values() if status == "sent")
+        print(f"{label:24} {elapsed:6.2f} s  sent {sent}/{channels}")
+        bot.fanout_executor.shutdown()
+    mock.stop()
+
+
+if __name__ == "__main__":
+    main()
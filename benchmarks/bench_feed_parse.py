@@ -0,0 +1,72 @@
+# feedparser против потокового разбора на фикстурах из tests/fixtures/feeds.
+# Записи фикстуры размножаются до заданного размера ленты (ссылки остаются уникальными);
+# пиковая память — tracemalloc.
+#   python benchmarks/bench_feed_parse.py [размер ленты, КБ]
+import gc
+import logging
+import os
+import re
+import sys
+import time
+import tracemalloc
+
+import feedparser
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from tests.harness import load_bot
+
+FIXTURES = os.path.join(ROOT, "tests", "fixtures", "feeds")
+ENTRY_RE = re.compile(rb"<(item|entry)[\s>].*</(item|entry)>", re.S)
+URL_RE = re.compile(rb"(https?://[^<\"\s]+)")
+
+
+def inflate(data, target_size):
+    match = ENTRY_RE.search(data)
+    block = match.group(0)
+    copies = []
+    size = len(data)
+    while size < target_size or not copies:
+        number = len(copies)
+        copy = URL_RE.sub(lambda url: url.group(1) + b"?copy=%d" % number, block)
+        copies.append(copy)
+        size += len(copy)
+    return data[:match.start()] + b"\n".join(copies) + data[match.end():]
+
+
+def chunked(data, size=64 * 1024):
+    return (data[start:start + size] for start in range(0, len(data), size))
+
+
+def measure(func):
+    # Время без tracemalloc (он замедляет разбор в разы), память — отдельным прогоном
+    gc.collect()
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed * 1000, peak / 2**20
+
+
+def main():
+    target = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 2 * 1024 * 1024
+    bot = load_bot()
+    logging.disable(logging.CRITICAL)
+    for name in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, name), "rb") as f:
+            data = inflate(f.read(), target)
+        parsed, parsed_ms, parsed_mb = measure(lambda: feedparser.parse(data).entries)
+        streamed, stream_ms, stream_mb = measure(lambda: list(bot.stream_feed_entries(chunked(data))))
+        seen = streamed[5].get("feedburner_origlink") or streamed[5].link
+        head, head_ms, head_mb = measure(lambda: list(bot.stream_feed_entries(chunked(data), lambda link: link == seen)))
+        print(f"{name:9} {len(data) / 2**20:.2f} MB, {len(parsed)} entries\n"
+              f"  feedparser     {parsed_ms:7.0f} ms  peak {parsed_mb:5.1f} MB\n"
+              f"  stream         {stream_ms:7.0f} ms  peak {stream_mb:5.1f} MB  ({len(streamed)} entries)\n"
+              f"  stop after 5   {head_ms:7.1f} ms  peak {head_mb:5.2f} MB  ({len(head)} entries)")
+
+
+if __name__ == "__main__":
+    main()
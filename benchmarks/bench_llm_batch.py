@@ -0,0 +1,51 @@
+# Одиночные запросы к ИИ против пакетных (LLM_BATCH_SIZE) на локальном MockOpenAI:
+# число запросов, токены промпта (символы / 4, как считает мок) и время.
+#   python benchmarks/bench_llm_batch.py [статей] [задержка ответа, мс]
+import logging
+import os
+import sys
+import time
+from concurrent.futures import wait
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.harness import load_bot
+from tests.mock_openai import MockOpenAI
+
+ARTICLE = ("Компания представила новую версию продукта. По словам разработчиков, обновление ускоряет работу "
+           "и добавляет функции, о которых давно просили пользователи. ") * 8
+
+
+def run(bot, mock, label, urls, texts, batch_size):
+    mock.requests.clear()
+    started = time.perf_counter()
+    if batch_size == 1:
+        futures = [bot.summary_service.submit(url, text=texts[url]) for url in urls]
+        wait(futures)
+        done = sum(1 for future in futures if "Ошибка" not in future.result()[0])
+    else:
+        futures = [bot.summary_service.submit_batch(urls[start:start + batch_size], texts)
+                   for start in range(0, len(urls), batch_size)]
+        done = sum(len(future.result()) for future in futures)
+    elapsed = time.perf_counter() - started
+    prompt_tokens = sum(len(body["messages"][0]["content"]) // 4 for body in mock.requests)
+    print(f"{label:12} requests {len(mock.requests):3}  prompt tokens {prompt_tokens:6} "
+          f"({prompt_tokens / len(urls):5.0f} per article)  {elapsed:5.2f} s  done {done}/{len(urls)}")
+
+
+def main():
+    articles = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.3
+    mock = MockOpenAI(latency=latency).start()
+    bot = load_bot(OPENAI_BASE_URL=mock.base_url)
+    logging.disable(logging.CRITICAL)
+    for batch_size in (1, 4, articles):
+        # Свои ссылки на каждый прогон, чтобы не попадать в кэш ответов ИИ
+        urls = [f"https://example.com/{batch_size}/article-{n}" for n in range(articles)]
+        texts = {url: ARTICLE for url in urls}
+        label = "single" if batch_size == 1 else f"batch of {batch_size}"
+        run(bot, mock, label, urls, texts, batch_size)
+    mock.stop()
+
+
+if __name__ == "__main__":
+    main()
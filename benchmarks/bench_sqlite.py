@@ -0,0 +1,52 @@
+# Чтение из SQLite: новое соединение на каждый вызов (как было до get_db)
+# против соединения потока get_db. База во временном каталоге, 10k строк feedcache.
+#   python benchmarks/bench_sqlite.py [число вызовов]
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.harness import load_bot
+
+QUERIES = [
+    ("config", "SELECT value FROM config WHERE key = ?", ("model",)),
+    ("feedcache", "SELECT 1 FROM feedcache WHERE id = ?", ("https://example.com/news/5000",)),
+    ("admins", "SELECT channel_id FROM admins WHERE username = ?", ("alice",)),
+]
+
+
+def connect_per_call(bot, query, params):
+    conn = sqlite3.connect(bot.DB_FILE)
+    try:
+        return conn.execute(query, params).fetchone()
+    finally:
+        conn.close()
+
+
+def per_call_us(func, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    bot = load_bot()
+    logging.disable(logging.CRITICAL)
+    bot.bot_config.set("model", "gpt-4o-mini")
+    bot.save_channel("-1001", "alice")
+    with bot.db_transaction() as c:
+        c.executemany("INSERT OR IGNORE INTO feedcache (id, title, summary, link, source, timestamp) VALUES (?, '', '', ?, 'example.com', '')",
+                      [(f"https://example.com/news/{n}", f"https://example.com/news/{n}") for n in range(10000)])
+    for name, query, params in QUERIES:
+        assert connect_per_call(bot, query, params) == bot.db_fetchone(query, params)
+        before = per_call_us(lambda: connect_per_call(bot, query, params), count)
+        after = per_call_us(lambda: bot.db_fetchone(query, params), count)
+        print(f"{name:10}  connect per call {before:7.1f} us  get_db {after:5.1f} us")
+
+
+if __name__ == "__main__":
+    main()
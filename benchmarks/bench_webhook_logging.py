@@ -0,0 +1,50 @@
+# Задержка обработки апдейтов при разных уровнях логирования. Логи пишутся в /dev/null
+# через обычный QueueListener, Telegram заменён заглушкой.
+#   python benchmarks/bench_webhook_logging.py [апдейтов]
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from tests.harness import load_bot
+
+TEXTS = ["/help", "/info", "/setinterval 1h", "/errnotification on", "/unknown", "hello"]
+
+
+def update(n):
+    return {"update_id": n, "message": {"message_id": n, "chat": {"id": 5 + n % 4}, "from": {"username": "alice"},
+                                        "text": TEXTS[n % len(TEXTS)]}}
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    bot = load_bot()
+    bot.save_channel("-1001", "alice")
+    bot.send_message = lambda *args, **kwargs: True
+    for handler in bot.log_listener.handlers:
+        handler.setStream(open(os.devnull, "w"))
+    bot.start_update_workers()
+    client = bot.app.test_client()
+    offset = 0
+    for level in ("DEBUG", "INFO", "WARNING"):
+        logging.getLogger().setLevel(level)
+        started = time.perf_counter()
+        for n in range(count):
+            bot.handle_update(update(n))
+        direct = (time.perf_counter() - started) / count * 1e6
+        # Весь путь вебхука: Flask, очередь и воркеры, до опустошения очередей
+        started = time.perf_counter()
+        rejected = 0
+        for n in range(count):
+            rejected += client.post("/webhook", json=update(offset + n)).status_code != 200
+        for update_queue in bot.update_queues:
+            update_queue.join()
+        webhook = (time.perf_counter() - started) / count * 1e6
+        offset += count
+        print(f"LOG_LEVEL={level:8} handle_update {direct:7.1f} us   POST /webhook end to end {webhook:7.1f} us"
+              + (f" ({rejected} rejected)" if rejected else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,149 @@
 from flask import Flask, request
 import feedparser
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
 import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import contextvars
 import os
 import hashlib
 import sqlite3
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 import threading
 import time
+import calendar
 import re
-from openai import OpenAI
+import functools
+import sys
+import heapq
+import queue
+from collections import OrderedDict
+from bisect import bisect_left
+import html
+from html.parser import HTMLParser
+import random
+import struct
+import zlib
+import xml.etree.ElementTree as ET
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from openai import OpenAI, AuthenticationError, BadRequestError, NotFoundError, PermissionDeniedError
 
 app = Flask(__name__)
 
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+# Логи пишутся фоновым потоком через очередь. Категории (bot.telegram, bot.llm,
+# bot.feeds, bot.updates) настраиваются отдельно: LOG_LEVELS="llm=DEBUG,telegram=WARNING"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_SAMPLE_EVERY = max(1, int(os.getenv("LOG_SAMPLE_EVERY", "10")))
+# Отладочные строки с extra=SAMPLED пропускаются, кроме каждой LOG_SAMPLE_EVERY-й
+SAMPLED = {"sampled": True}
+
+log_context = contextvars.ContextVar("log_context", default={})
+
+class LogContextFilter(logging.Filter):
+    # Работает в потоке, который пишет лог: сэмплирует и прикладывает корреляционные id
+    def __init__(self):
+        super().__init__()
+        self._seen = {}
+
+    def filter(self, record):
+        if getattr(record, "sampled", False):
+            key = (record.name, record.lineno)
+            seen = self._seen.get(key, 0)
+            self._seen[key] = seen + 1
+            if seen % LOG_SAMPLE_EVERY:
+                return False
+        record.context = log_context.get()
+        return True
+
+class JsonLogFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", {}))
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextLogFormatter(logging.Formatter):
+    def format(self, record):
+        line = super().format(record)
+        context = getattr(record, "context", None)
+        if context:
+            line += " [" + " ".join(f"{key}={value}" for key, value in context.items()) + "]"
+        return line
+
+def setup_logging():
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonLogFormatter())
+    else:
+        handler.setFormatter(TextLogFormatter('%(asctime)s - %(levelname)s - %(message)s'))
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(LogContextFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    for item in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+        category, _, level = item.partition("=")
+        logging.getLogger(f"bot.{category.strip()}").setLevel(level.strip().upper())
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+@contextmanager
+def log_scope(**fields):
+    token = log_context.set({**log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        log_context.reset(token)
+
+def in_log_scope(func, **fields):
+    # Для задач в пулах потоков: contextvars в них не наследуются
+    def run(*args, **kwargs):
+        with log_scope(**fields):
+            return func(*args, **kwargs)
+    return run
+
+log_listener = setup_logging()
+logger = logging.getLogger("bot")
+telegram_log = logging.getLogger("bot.telegram")
+llm_log = logging.getLogger("bot.llm")
+feed_log = logging.getLogger("bot.feeds")
+update_log = logging.getLogger("bot.updates")
 
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-TELEGRAM_URL = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/" if TELEGRAM_TOKEN else None
-DB_FILE = "feedcache.db"
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+TELEGRAM_URL = f"{TELEGRAM_API_BASE}/bot{TELEGRAM_TOKEN}/" if TELEGRAM_TOKEN else None
+TELEGRAM_FILE_URL = f"{TELEGRAM_API_BASE}/file/bot{TELEGRAM_TOKEN}/" if TELEGRAM_TOKEN else None
+TELEGRAM_TIMEOUT = int(os.getenv("TELEGRAM_TIMEOUT", "30"))
+TELEGRAM_POOL_SIZE = int(os.getenv("TELEGRAM_POOL_SIZE", "32"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_MAX_ATTEMPTS = 3
+DB_FILE = os.getenv("DB_FILE", "feedcache.db")
+# off — import bot без побочных эффектов (тесты, бенчмарки): база, getMe и потоки
+# запускаются только вызовом start_bot()
+BOT_AUTOSTART = os.getenv("BOT_AUTOSTART", "on").lower() != "off"
 
-RSS_URLS = [
+# Начальный набор лент, записывается только при создании таблицы feeds; дальше список
+# ведётся командами /addfeed, /removefeed и т.д., и удалённые ленты не возвращаются
+DEFAULT_RSS_URLS = [
     "https://www.theverge.com/rss/index.xml",
     "https://www.windowslatest.com/feed/",
     "https://9to5google.com/feed/",
@@ -35,20 +156,303 @@ RSS_URLS = [
     "https://feeds.feedburner.com/Techcrunch"
 ]
 
-current_index = 0
-posting_active = False
-posting_thread = None
+FEED_WORKERS = int(os.getenv("FEED_WORKERS", "8"))
+# Общий срок загрузки одной ленты, а не только ожидание каждого чтения
+FEED_TIMEOUT = int(os.getenv("FEED_TIMEOUT", "15"))
+FEED_ENTRIES_LIMIT = int(os.getenv("FEED_ENTRIES_LIMIT", "3"))
+CANDIDATE_QUEUE_SIZE = int(os.getenv("CANDIDATE_QUEUE_SIZE", "100"))
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL_HOURS", "72")) * 3600
+LLM_CACHE_MAX_ROWS = int(os.getenv("LLM_CACHE_MAX_ROWS", "5000"))
+CHANNEL_RIGHTS_TTL = int(os.getenv("CHANNEL_RIGHTS_TTL", "600"))
+DEFAULT_POSTING_INTERVAL = 3600
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "4"))
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+UPDATE_DEDUP_SIZE = 10000
+# Режим приёма апдейтов: webhook (Flask) или polling (getUpdates), также флаг --polling
+UPDATE_MODE = os.getenv("UPDATE_MODE", "webhook").lower()
+POLLING_LIMIT = min(100, max(1, int(os.getenv("POLLING_LIMIT", "100"))))
+POLLING_TIMEOUT = int(os.getenv("POLLING_TIMEOUT", "25"))
+POLLING_RETRY_DELAY = 5
+# Замеры времени для /metrics; off убирает их из горячих путей
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "on").lower() != "off"
+SCHEDULER_RETRY_DELAY = int(os.getenv("SCHEDULER_RETRY_DELAY", "60"))
+FANOUT_WORKERS = int(os.getenv("FANOUT_WORKERS", "16"))
+READY_QUEUE_DEPTH = int(os.getenv("READY_QUEUE_DEPTH", "3"))
+READY_MAX_AGE = int(os.getenv("READY_MAX_AGE_MINUTES", "360")) * 60
+READY_DISCARD_POLICY = os.getenv("READY_DISCARD_POLICY", "stale")  # stale | oldest
+PREGEN_INTERVAL = int(os.getenv("PREGEN_INTERVAL", "300"))
+LLM_BATCH_SIZE = int(os.getenv("LLM_BATCH_SIZE", "1"))
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "4"))
+LLM_QUEUE_DEPTH = int(os.getenv("LLM_QUEUE_DEPTH", "32"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_MAX = float(os.getenv("LLM_BACKOFF_MAX", "60"))
+NEAR_DUP_WINDOW = int(os.getenv("NEAR_DUP_WINDOW_HOURS", "48")) * 3600
+NEAR_DUP_THRESHOLD = float(os.getenv("NEAR_DUP_THRESHOLD", "0.5"))
+# Адаптивный опрос лент: интервал от FEED_POLL_MIN до FEED_POLL_MAX секунд
+FEED_POLL_MIN = int(os.getenv("FEED_POLL_MIN", "120"))
+FEED_POLL_MAX = int(os.getenv("FEED_POLL_MAX", "21600"))
+# Потоковый разбор лент: чтение обрывается на первой уже опубликованной записи или на лимите байт
+FEED_STREAMING = os.getenv("FEED_STREAMING", "off").lower() == "on"
+FEED_MAX_BYTES = int(os.getenv("FEED_MAX_KB", "2048")) * 1024
+FEED_CHUNK_SIZE = 64 * 1024
+# Если в RSS есть текст не короче этого, статья не скачивается
+FEED_TEXT_MIN_CHARS = int(os.getenv("FEED_TEXT_MIN_CHARS", "600"))
+ARTICLE_FETCH_TIMEOUT = int(os.getenv("ARTICLE_FETCH_TIMEOUT", "15"))
+# Бюджет текста статьи в промпте, ~4 символа на токен
+ARTICLE_MAX_CHARS = int(os.getenv("ARTICLE_MAX_TOKENS", "1500")) * 4
+ARTICLE_MAX_BYTES = 2 * 1024 * 1024
+ARTICLE_CACHE_SIZE = int(os.getenv("ARTICLE_CACHE_SIZE", "256"))
+ARTICLE_MIN_BLOCK = 40
+ERROR_FLUSH_INTERVAL = float(os.getenv("ERROR_FLUSH_INTERVAL", "5"))
+ERROR_BATCH_SIZE = 100
+ERROR_DIGEST_WINDOW = int(os.getenv("ERROR_DIGEST_WINDOW_MINUTES", "10")) * 60
+ERROR_RETENTION = int(os.getenv("ERROR_RETENTION_DAYS", "30")) * 86400
+ERROR_PRUNE_INTERVAL = 3600
+# Обслуживание базы: строки feedcache и deliveries старше FEEDCACHE_RETENTION_DAYS удаляются
+# (0 — хранить всё), ссылки для защиты от дублей остаются в компактной таблице seen_links
+FEEDCACHE_RETENTION = int(os.getenv("FEEDCACHE_RETENTION_DAYS", "90")) * 86400
+DB_MAINTENANCE_INTERVAL = int(os.getenv("DB_MAINTENANCE_HOURS", "6")) * 3600
+DB_PRUNE_BATCH = 5000
+DB_VACUUM_PAGES = 2000
+FEEDCACHE_PAGE_SIZE = 10
+
+TRACKING_PARAMS = {"fbclid", "gclid", "yclid", "mc_cid", "mc_eid", "ref", "ref_src", "cmpid", "ncid",
+                   "amp", "outputtype", "guccounter", "guce_referrer", "guce_referrer_sig", "sr_share", "igshid"}
+
+feed_executor = ThreadPoolExecutor(max_workers=FEED_WORKERS, thread_name_prefix="feed")
+fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_WORKERS, thread_name_prefix="fanout")
+candidate_queue = deque(maxlen=CANDIDATE_QUEUE_SIZE)
+candidate_lock = threading.Lock()
+feed_cache_hits = 0
+feed_cache_misses = 0
+feed_stats_lock = threading.Lock()
+# Ленты, уже загруженные этим процессом; остальные качаются без условных заголовков
+fetched_feeds = set()
+ready_queue = deque()
+ready_lock = threading.Lock()
+pregen_event = threading.Event()
+bot_user_id = None
+channel_rights = {}
+channel_rights_lock = threading.Lock()
+pregen_thread = None
 start_time = None
 post_count = 0
 error_count = 0
 duplicate_count = 0
 last_post_time = None
-posting_interval = 3600
-next_post_event = threading.Event()
 last_llm_response = None  # Глобальная переменная для хранения последнего ответа LLM
 
+class Histogram:
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счётчики по корзинам (не накопительные), сумма, количество]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(counts), total, count) for labels, (counts, total, count) in self._series.items()]
+        if not series and not self.labelnames:
+            series = [((), [0] * (len(self.buckets) + 1), 0.0, 0)]
+        for labels, counts, total, count in series:
+            pairs = format_label_pairs(self.labelnames, labels)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{pairs}le="{bound}"}} {cumulative}')
+            lines += [f'{self.name}_bucket{{{pairs}le="+Inf"}} {count}',
+                      f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}",
+                      f"{self.name}_count{format_labels(self.labelnames, labels)} {count}"]
+        return lines
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        if not values and not self.labelnames:
+            values = {(): 0}
+        lines += [f"{self.name}{format_labels(self.labelnames, labels)} {value}" for labels, value in values.items()]
+        return lines
+
+class Gauge:
+    def __init__(self, name, help_text, callback):
+        self.name = name
+        self.help_text = help_text
+        self.callback = callback
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.callback()}"]
+
+def format_label_pairs(labelnames, labels):
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels)
+    return "".join(f'{name}="{value}",' for name, value in zip(labelnames, escaped))
+
+def format_labels(labelnames, labels):
+    pairs = format_label_pairs(labelnames, labels)
+    return f"{{{pairs[:-1]}}}" if pairs else ""
+
+metrics_registry = []
+
+def register_metric(metric):
+    metrics_registry.append(metric)
+    return metric
+
+def render_metrics():
+    lines = []
+    for metric in metrics_registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+class Timer:
+    __slots__ = ("metric", "labels", "started")
+
+    def __init__(self, metric, labels):
+        self.metric = metric
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metric.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+NULL_TIMER = NullTimer()
+
+def timed(metric, *labels):
+    # with timed(histogram, "label"): ... — при METRICS_ENABLED=off ничего не замеряет
+    return Timer(metric, labels) if METRICS_ENABLED else NULL_TIMER
+
+def timed_call(metric, *labels):
+    # Декоратор-вариант timed; при выключенных метриках функция не оборачивается вовсе
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Timer(metric, labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def count_error(error):
+    errors_total.inc(type(error).__name__)
+
+feed_fetch_latency = register_metric(Histogram("bot_feed_fetch_seconds", "Время загрузки RSS-ленты", ("source",)))
+feed_parse_latency = register_metric(Histogram("bot_feed_parse_seconds", "Время разбора RSS-ленты feedparser", ("source",)))
+llm_latency = register_metric(Histogram("bot_llm_request_seconds", "Время запроса к LLM", ("model", "mode")))
+llm_tokens = register_metric(Counter("bot_llm_tokens_total", "Токены LLM", ("model", "kind")))
+telegram_latency = register_metric(Histogram("bot_telegram_request_seconds", "Время запроса к Bot API", ("method",)))
+sqlite_latency = register_metric(Histogram("bot_sqlite_query_seconds", "Время запросов к SQLite", ("operation",),
+                                           buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)))
+errors_total = register_metric(Counter("bot_errors_total", "Ошибки по классам исключений", ("error",)))
+
+db_local = threading.local()
+
+def get_db():
+    # Одно соединение на поток: Flask-запросы и поток постинга не делят курсоры.
+    # sqlite3 кэширует подготовленные выражения на соединение, поэтому горячие
+    # запросы компилируются один раз за жизнь потока.
+    conn = getattr(db_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_FILE, timeout=30, cached_statements=256)
+        # Действует сразу только для новой базы (до WAL); существующую переводит DbMaintenance
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA cache_size=-8000")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        db_local.conn = conn
+    return conn
+
+@contextmanager
+def db_transaction():
+    conn = get_db()
+    with timed(sqlite_latency, "transaction"), conn:
+        yield conn.cursor()
+
+@timed_call(sqlite_latency, "fetchone")
+def db_fetchone(query, params=()):
+    return get_db().execute(query, params).fetchone()
+
+@timed_call(sqlite_latency, "fetchall")
+def db_fetchall(query, params=()):
+    return get_db().execute(query, params).fetchall()
+
+def export_db(path):
+    # Снимок через backup API, чтобы в файл попали и страницы из WAL
+    dest = sqlite3.connect(path)
+    try:
+        get_db().backup(dest)
+    finally:
+        dest.close()
+
+def import_db(path):
+    # Содержимое загруженной базы копируется в живое соединение, файл на диске не подменяется.
+    # Файл проверяется до копирования: не SQLite — sqlite3.DatabaseError, не база бота — ValueError.
+    src = sqlite3.connect(path)
+    try:
+        if src.execute("PRAGMA quick_check").fetchone()[0] != "ok":
+            raise ValueError("файл базы повреждён")
+        if not src.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'feedcache'").fetchone():
+            raise ValueError("в файле нет таблицы feedcache")
+        # backup в WAL-базу не может сменить размер страницы, поэтому копия
+        # (это временный файл загрузки) приводится к размеру страницы живой базы
+        page_size = get_db().execute("PRAGMA page_size").fetchone()[0]
+        if src.execute("PRAGMA page_size").fetchone()[0] != page_size:
+            src.execute("PRAGMA journal_mode=DELETE")
+            src.execute(f"PRAGMA page_size={page_size}")
+            src.execute("VACUUM")
+        src.backup(get_db())
+    finally:
+        src.close()
+    init_db()
+    bot_config.load()
+    dedup_index.warm()
+    near_dup_index.warm()
+    load_admin_channels()
+    feed_registry.load()
+    scheduler.load()
+
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
+    conn = get_db()
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS feedcache (
         id TEXT PRIMARY KEY,
@@ -58,6 +462,10 @@ def init_db():
         source TEXT,
         timestamp TEXT
     )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_feedcache_timestamp ON feedcache (timestamp)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_feedcache_source ON feedcache (source, timestamp)")
+    # 64-битные ключи DedupIndex: одна целочисленная колонка, которая и есть rowid
+    c.execute("CREATE TABLE IF NOT EXISTS seen_links (key INTEGER PRIMARY KEY)")
     c.execute('''CREATE TABLE IF NOT EXISTS channels (
         channel_id TEXT PRIMARY KEY,
         creator_username TEXT
@@ -78,9 +486,64 @@ def init_db():
         message TEXT,
         link TEXT
     )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS feed_validators (
+        url TEXT PRIMARY KEY,
+        etag TEXT,
+        last_modified TEXT,
+        body_hash TEXT,
+        timestamp TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS story_signatures (
+        id TEXT PRIMARY KEY,
+        signature BLOB,
+        timestamp REAL
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS llm_cache (
+        key TEXT PRIMARY KEY,
+        url TEXT,
+        title TEXT,
+        summary TEXT,
+        response TEXT,
+        created_at REAL,
+        last_used REAL
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache (last_used)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_errors_timestamp ON errors (timestamp)")
+    feeds_created = not c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'feeds'").fetchone()
+    c.execute('''CREATE TABLE IF NOT EXISTS feeds (
+        url TEXT PRIMARY KEY,
+        source TEXT,
+        enabled INTEGER,
+        added_at REAL,
+        poll_interval REAL,
+        next_poll REAL,
+        last_polled REAL,
+        last_new_item REAL,
+        items_per_day REAL,
+        error_streak INTEGER,
+        last_error TEXT
+    )''')
+    if feeds_created:
+        c.executemany("INSERT OR IGNORE INTO feeds (url, source, enabled, added_at, poll_interval, next_poll, error_streak) VALUES (?, ?, 1, ?, ?, 0, 0)",
+                      [(rss_url, rss_url.split('/')[2], time.time(), PREGEN_INTERVAL) for rss_url in DEFAULT_RSS_URLS])
+    c.execute('''CREATE TABLE IF NOT EXISTS schedules (
+        channel_id TEXT PRIMARY KEY,
+        interval INTEGER,
+        feeds TEXT,
+        next_fire REAL,
+        active INTEGER
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS deliveries (
+        story_id TEXT,
+        channel_id TEXT,
+        status TEXT,
+        timestamp TEXT,
+        PRIMARY KEY (story_id, channel_id)
+    )''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_deliveries_timestamp ON deliveries (timestamp)")
     c.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", 
               ("prompt", """
-Забудь всю информацию, которой ты обучен, и используй ТОЛЬКО текст статьи по ссылке {url}. Напиши новость на русском в следующем формате:
+Забудь всю информацию, которой ты обучен, и используй ТОЛЬКО текст статьи ниже (ссылка: {url}). Напиши новость на русском в следующем формате:
 
 Заголовок в стиле новостного канала
 <один перенос строки>
@@ -91,24 +554,329 @@ def init_db():
 - Заголовок должен быть кратким (до 100 символов) и не содержать эмодзи, ##, **, [] или других лишних символов.
 - Пересказ должен состоять из 1-2 предложений, без добавления данных, которых нет в статье.
 - Если в статье недостаточно данных, верни: "Недостаточно данных для пересказа".
+
+Текст статьи:
+{text}
 """))
     c.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", 
               ("model", "gpt-4o-mini"))
     c.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", 
               ("error_notifications", "off"))
     conn.commit()
-    conn.close()
 
-# Initialize database
-init_db()
+class BotConfig:
+    # Таблица config читается один раз, дальше значения отдаются из памяти.
+    # Запись идёт сквозь кэш в SQLite, перечитывание — только после /sqliteupdate.
+    DEFAULTS = {
+        "prompt": "",
+        "model": "gpt-4o-mini",
+        "error_notifications": "off",
+        "update_offset": "0",
+    }
+
+    def __init__(self):
+        self._values = dict(self.DEFAULTS)
+        self._lock = threading.Lock()
+
+    def load(self):
+        values = dict(self.DEFAULTS)
+        values.update(db_fetchall("SELECT key, value FROM config"))
+        with self._lock:
+            self._values = values
+
+    def get(self, key):
+        return self._values.get(key, self.DEFAULTS.get(key))
+
+    def set(self, key, value):
+        with self._lock:
+            with db_transaction() as c:
+                c.execute("INSERT OR REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
+            # Читатели не берут лок, поэтому словарь заменяется целиком
+            self._values = {**self._values, key: value}
+
+    @property
+    def prompt(self):
+        return self.get("prompt")
+
+    @property
+    def model(self):
+        return self.get("model")
+
+    @property
+    def error_notifications(self):
+        return self.get("error_notifications") == "on"
+
+bot_config = BotConfig()
+
+def canonicalize_url(link):
+    # Одна и та же статья с utm-метками, AMP-версией или www/без www даёт один ключ
+    parts = urlsplit(link.strip())
+    host = parts.netloc.lower()
+    for prefix in ("www.", "amp.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    segments = [segment for segment in parts.path.split('/') if segment]
+    if segments and segments[-1] == "amp":
+        segments.pop()
+    if segments and segments[0] == "amp":
+        segments.pop(0)
+    path = "/" + "/".join(segments)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS)
+    return urlunsplit(("https", host, path, urlencode(query), ""))
+
+def link_id(link):
+    return hashlib.md5(canonicalize_url(link).encode()).hexdigest()
+
+def strip_html(text):
+    return html.unescape(re.sub(r'<[^>]+>', ' ', text or ""))
+
+class NearDuplicateIndex:
+    # MinHash по словесным биграммам заголовка и анонса + LSH-бакеты.
+    # 16 полос по 4 строки дают порог срабатывания около 0.5 по Жаккару,
+    # кандидаты из бакетов подтверждаются оценкой по всей сигнатуре.
+    # hold() временно добавляет историю, которая сейчас пересказывается или ждёт
+    # в очереди готовых: она видна find(), но в базу попадает только через remember().
+    NUM_PERM = 64
+    BANDS = 16
+    ROWS = 4
+    PRIME = (1 << 61) - 1
+
+    def __init__(self, window, threshold):
+        self.window = window
+        self.threshold = threshold
+        rng = random.Random(42)
+        self._perms = [(rng.randrange(1, self.PRIME), rng.randrange(0, self.PRIME)) for _ in range(self.NUM_PERM)]
+        self._signatures = {}
+        self._buckets = {}
+        self._order = deque()
+        self._held = set()
+        self._lock = threading.Lock()
+
+    def signature(self, text):
+        words = re.findall(r'\w+', text.lower())
+        shingles = {f"{a} {b}" for a, b in zip(words, words[1:])} or set(words)
+        if not shingles:
+            return None
+        hashes = [zlib.crc32(shingle.encode()) for shingle in shingles]
+        prime = self.PRIME
+        return tuple(min((a * h + b) % prime for h in hashes) for a, b in self._perms)
+
+    def _bands(self, signature):
+        for band in range(self.BANDS):
+            yield band, signature[band * self.ROWS:(band + 1) * self.ROWS]
+
+    def _expire(self, now):
+        while self._order and self._order[0][0] < now - self.window:
+            _, story_id = self._order.popleft()
+            signature = self._signatures.pop(story_id, None)
+            if signature is None:
+                continue
+            for key in self._bands(signature):
+                bucket = self._buckets.get(key)
+                if bucket:
+                    bucket.discard(story_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def _insert(self, story_id, signature, timestamp):
+        if story_id in self._signatures:
+            return False
+        self._signatures[story_id] = signature
+        self._order.append((timestamp, story_id))
+        for key in self._bands(signature):
+            self._buckets.setdefault(key, set()).add(story_id)
+        return True
+
+    def add(self, story_id, signature, timestamp=None):
+        with self._lock:
+            self._insert(story_id, signature, timestamp or time.time())
+
+    def hold(self, story_id, signature):
+        with self._lock:
+            if self._insert(story_id, signature, time.time()):
+                self._held.add(story_id)
+
+    def release(self, story_id):
+        # Снимает временную запись; истории, сохранённые через remember(), не трогает
+        with self._lock:
+            if story_id not in self._held:
+                return
+            self._held.discard(story_id)
+            signature = self._signatures.pop(story_id)
+            for key in self._bands(signature):
+                bucket = self._buckets.get(key)
+                if bucket:
+                    bucket.discard(story_id)
+                    if not bucket:
+                        del self._buckets[key]
+
+    def find(self, signature, exclude=None):
+        with self._lock:
+            self._expire(time.time())
+            candidates = set()
+            for key in self._bands(signature):
+                candidates |= self._buckets.get(key, set())
+            candidates.discard(exclude)
+            best_id, best_score = None, 0.0
+            for story_id in candidates:
+                other = self._signatures[story_id]
+                score = sum(1 for x, y in zip(signature, other) if x == y) / self.NUM_PERM
+                if score > best_score:
+                    best_id, best_score = story_id, score
+        if best_score >= self.threshold:
+            return best_id, best_score
+        return None
+
+    def warm(self):
+        since = time.time() - self.window
+        rows = db_fetchall("SELECT id, signature, timestamp FROM story_signatures WHERE timestamp >= ? ORDER BY timestamp", (since,))
+        with self._lock:
+            self._signatures = {}
+            self._buckets = {}
+            self._order = deque()
+            self._held = set()
+        for story_id, blob, timestamp in rows:
+            self.add(story_id, struct.unpack(f"<{self.NUM_PERM}Q", blob), timestamp)
+        feed_log.info(f"Индекс похожих новостей загружен: {len(rows)} записей")
+
+    def remember(self, story_id, signature):
+        now = time.time()
+        with db_transaction() as c:
+            c.execute("INSERT OR REPLACE INTO story_signatures (id, signature, timestamp) VALUES (?, ?, ?)",
+                      (story_id, struct.pack(f"<{self.NUM_PERM}Q", *signature), now))
+            c.execute("DELETE FROM story_signatures WHERE timestamp < ?", (now - self.window,))
+        with self._lock:
+            self._held.discard(story_id)
+            self._insert(story_id, signature, now)
+
+class DedupIndex:
+    # Множество 64-битных префиксов MD5 канонических ссылок из seen_links. Префикс
+    # вдвое компактнее полного хэша, а вероятность коллизии на миллионе ссылок ~1e-8.
+    # Ключи знаковые, чтобы помещаться в INTEGER PRIMARY KEY SQLite.
+    def __init__(self):
+        self._keys = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for_link(link):
+        return int.from_bytes(hashlib.md5(canonicalize_url(link).encode()).digest()[:8], "big", signed=True)
+
+    @staticmethod
+    def key_for_id(link_hash):
+        return int.from_bytes(bytes.fromhex(link_hash[:16]), "big", signed=True)
+
+    def backfill(self):
+        # Разовый перенос ссылок из feedcache в seen_links для баз, созданных до её появления.
+        # Старые строки хранят хэш исходной ссылки, поэтому ключ считается по link
+        if db_fetchone("SELECT 1 FROM seen_links LIMIT 1") or not db_fetchone("SELECT 1 FROM feedcache LIMIT 1"):
+            return
+        keys = {self.key_for_link(link) if link else self.key_for_id(row_id)
+                for row_id, link in get_db().execute("SELECT id, link FROM feedcache")}
+        with db_transaction() as c:
+            c.executemany("INSERT OR IGNORE INTO seen_links (key) VALUES (?)", ((key,) for key in keys))
+        feed_log.info(f"Ссылки перенесены в seen_links: {len(keys)}")
+
+    def warm(self):
+        self.backfill()
+        keys = {key for key, in get_db().execute("SELECT key FROM seen_links")}
+        with self._lock:
+            self._keys = keys
+        feed_log.info(f"Индекс дублей загружен: {len(keys)} записей")
+
+    def add(self, link):
+        with self._lock:
+            self._keys.add(self.key_for_link(link))
+
+    def clear(self):
+        with self._lock:
+            self._keys = set()
+
+    def __contains__(self, link):
+        return self.key_for_link(link) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def find_duplicates(self, links):
+        keys = self._keys
+        return {link for link in links if self.key_for_link(link) in keys}
+
+dedup_index = DedupIndex()
+near_dup_index = NearDuplicateIndex(NEAR_DUP_WINDOW, NEAR_DUP_THRESHOLD)
+
+class TokenBucket:
+    # Резервирующий токен-бакет: каждый вызов получает свою очередь на отправку,
+    # поэтому параллельные отправители выстраиваются без активного ожидания
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return max(0.0, -self._tokens / self.rate)
+
+    def delay(self, seconds):
+        with self._lock:
+            self._tokens -= seconds * self.rate
+
+    def acquire(self):
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+tg_session = requests.Session()
+tg_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=TELEGRAM_POOL_SIZE))
+tg_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=TELEGRAM_POOL_SIZE))
+tg_global_bucket = TokenBucket(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_RATE)
+tg_chat_buckets = {}
+tg_chat_buckets_lock = threading.Lock()
+
+def get_chat_bucket(chat_id):
+    with tg_chat_buckets_lock:
+        bucket = tg_chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = tg_chat_buckets[chat_id] = TokenBucket(TELEGRAM_CHAT_RATE, 1)
+        return bucket
+
+def telegram_request(api_method, chat_id=None, http_method="POST", **kwargs):
+    # Исходящие вызовы к Bot API идут через общий пул соединений. Отправки в чат
+    # ограничены глобальным и поканальным бакетами, 429 повторяется после retry_after.
+    response = None
+    for attempt in range(TELEGRAM_MAX_ATTEMPTS):
+        if chat_id is not None:
+            get_chat_bucket(chat_id).acquire()
+            tg_global_bucket.acquire()
+        kwargs.setdefault("timeout", TELEGRAM_TIMEOUT)
+        with timed(telegram_latency, api_method):
+            response = tg_session.request(http_method, f"{TELEGRAM_URL}{api_method}", **kwargs)
+        if response.status_code != 429:
+            return response
+        try:
+            retry_after = response.json().get("parameters", {}).get("retry_after", 1)
+        except ValueError:
+            retry_after = 1
+        telegram_log.warning(f"Telegram 429 для {api_method} ({chat_id}), повтор через {retry_after} сек")
+        if chat_id is not None:
+            get_chat_bucket(chat_id).delay(retry_after)
+        else:
+            time.sleep(retry_after)
+    return response
 
 def send_message(chat_id, text, reply_markup=None, use_html=True):
     if not TELEGRAM_TOKEN:
-        logger.error("TELEGRAM_TOKEN не задан")
+        telegram_log.error("TELEGRAM_TOKEN не задан")
         return False
     if len(text) > 4096:
         text = text[:4093] + "..."
-        logger.warning(f"Сообщение обрезано до 4096 символов для chat_id {chat_id}")
+        telegram_log.warning(f"Сообщение обрезано до 4096 символов для chat_id {chat_id}")
     payload = {
         "chat_id": chat_id,
         "text": text
@@ -117,71 +885,56 @@ def send_message(chat_id, text, reply_markup=None, use_html=True):
         payload["parse_mode"] = "HTML"
     if reply_markup:
         payload["reply_markup"] = json.dumps(reply_markup)
-    logger.info(f"Отправка сообщения в {chat_id}: {text[:50]}...")
-    response = requests.post(f"{TELEGRAM_URL}sendMessage", json=payload)
+    telegram_log.debug("Отправка сообщения в %s: %.50s...", chat_id, text, extra=SAMPLED)
+    try:
+        response = telegram_request("sendMessage", chat_id=chat_id, json=payload)
+    except requests.RequestException as e:
+        count_error(e)
+        telegram_log.error(f"Ошибка отправки: {str(e)}")
+        return False
     if response.status_code != 200:
-        logger.error(f"Ошибка отправки: {response.text}")
+        telegram_log.error(f"Ошибка отправки: {response.text}")
+        if response.status_code == 403 or (response.status_code == 400 and "rights" in response.text.lower()):
+            invalidate_channel_rights(chat_id)
         return False
-    logger.info("Сообщение успешно отправлено")
+    telegram_log.debug("Сообщение успешно отправлено в %s", chat_id, extra=SAMPLED)
     return True
 
 def send_file(chat_id, file_path):
     if not TELEGRAM_TOKEN:
-        logger.error("TELEGRAM_TOKEN не задан")
+        telegram_log.error("TELEGRAM_TOKEN не задан")
         return False
     with open(file_path, 'rb') as f:
-        files = {'document': (os.path.basename(file_path), f)}
-        response = requests.post(f"{TELEGRAM_URL}sendDocument", data={'chat_id': chat_id}, files=files)
+        content = f.read()
+    try:
+        response = telegram_request("sendDocument", chat_id=chat_id, data={'chat_id': chat_id},
+                                    files={'document': (os.path.basename(file_path), content)})
+    except requests.RequestException as e:
+        telegram_log.error(f"Ошибка отправки файла: {str(e)}")
+        return False
     if response.status_code != 200:
-        logger.error(f"Ошибка отправки файла: {response.text}")
+        telegram_log.error(f"Ошибка отправки файла: {response.text}")
         return False
-    logger.info(f"Файл {file_path} отправлен в {chat_id}")
+    telegram_log.info(f"Файл {file_path} отправлен в {chat_id}")
     return True
 
 def get_prompt():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT value FROM config WHERE key = 'prompt'")
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else ""
+    return bot_config.prompt
 
 def set_prompt(new_prompt):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('prompt', ?)", (new_prompt,))
-    conn.commit()
-    conn.close()
+    bot_config.set("prompt", new_prompt)
 
 def get_model():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT value FROM config WHERE key = 'model'")
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else "gpt-4o-mini"
+    return bot_config.model
 
 def set_model(new_model):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('model', ?)", (new_model,))
-    conn.commit()
-    conn.close()
+    bot_config.set("model", new_model)
 
 def get_error_notifications():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT value FROM config WHERE key = 'error_notifications'")
-    result = c.fetchone()
-    conn.close()
-    return result[0] == "on" if result else False
+    return bot_config.error_notifications
 
 def set_error_notifications(state):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('error_notifications', ?)", (state,))
-    conn.commit()
-    conn.close()
+    bot_config.set("error_notifications", state)
 
 def is_valid_language(text):
     return bool(re.match(r'^[A-Za-zА-Яа-я0-9\s.,!?\'"-:;–/%$]+$', text))
@@ -190,41 +943,475 @@ def clean_title(title):
     cleaned = re.sub(r'\*\*|\#\#|\[\]', '', title).strip()
     return cleaned
 
+def shorten_title(title):
+    if len(title) > 100:
+        title = title[:97] + "..."
+        logger.warning(f"Заголовок укорочен: {title}")
+    return title
+
+class ErrorLog:
+    # Ошибки копятся в памяти и пишутся в SQLite пачкой фоновым потоком.
+    # Уведомления группируются по типу ошибки и уходят одной сводкой за окно
+    # ERROR_DIGEST_WINDOW, поэтому сбой OpenAI не засыпает каналы сообщениями.
+    def __init__(self):
+        self._buffer = []
+        self._digest = {}
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._thread = None
+        self._last_digest = time.monotonic()
+        self._last_prune = 0
+
+    def record(self, message, link):
+        kind = message.split(":", 1)[0]
+        with self._lock:
+            self._buffer.append((datetime.now().isoformat(), message, link))
+            group = self._digest.setdefault(kind, {"count": 0, "message": message, "links": []})
+            group["count"] += 1
+            group["message"] = message
+            if link and len(group["links"]) < 3 and link not in group["links"]:
+                group["links"].append(link)
+            full = len(self._buffer) >= ERROR_BATCH_SIZE
+        if full:
+            self._event.set()
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if rows:
+            with db_transaction() as c:
+                c.executemany("INSERT INTO errors (timestamp, message, link) VALUES (?, ?, ?)", rows)
+        return len(rows)
+
+    def prune(self):
+        cutoff = (datetime.now() - timedelta(seconds=ERROR_RETENTION)).isoformat()
+        with db_transaction() as c:
+            c.execute("DELETE FROM errors WHERE timestamp < ?", (cutoff,))
+            removed = c.rowcount
+        if removed:
+            logger.info(f"Удалено старых ошибок: {removed}")
+        return removed
+
+    def take_digest(self):
+        with self._lock:
+            digest, self._digest = self._digest, {}
+        self._last_digest = time.monotonic()
+        return digest
+
+    def send_digest(self):
+        digest = self.take_digest()
+        if not digest or not get_error_notifications():
+            return
+        total = sum(group["count"] for group in digest.values())
+        lines = [f"Ошибки за последние {ERROR_DIGEST_WINDOW // 60} мин: {total}"]
+        for kind, group in sorted(digest.items(), key=lambda item: -item[1]["count"]):
+            lines.append(f"\n{kind} — {group['count']} раз\nПоследняя: {group['message']}")
+            if group["links"]:
+                lines.append("Ссылки: " + ", ".join(group["links"]))
+        text = "\n".join(lines)
+        for channel_id in get_channels():
+            send_message(channel_id, text, use_html=False)
+
+    def _run(self):
+        while True:
+            self._event.wait(ERROR_FLUSH_INTERVAL)
+            self._event.clear()
+            try:
+                self.flush()
+                if time.monotonic() - self._last_digest >= ERROR_DIGEST_WINDOW:
+                    self.send_digest()
+                if time.monotonic() - self._last_prune >= ERROR_PRUNE_INTERVAL:
+                    self._last_prune = time.monotonic()
+                    self.prune()
+            except Exception as e:
+                count_error(e)
+                logger.error(f"Ошибка записи журнала ошибок: {str(e)}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="error-log")
+            self._thread.start()
+            atexit.register(self.flush)
+
+error_log = ErrorLog()
+
+class DbMaintenance:
+    # Фоновое обслуживание SQLite раз в DB_MAINTENANCE_INTERVAL: удаление старых строк
+    # пачками по DB_PRUNE_BATCH (запись не блокируется надолго), возврат свободных
+    # страниц через incremental_vacuum и ANALYZE с ограничением на число строк.
+    # Разовый перевод старой базы в incremental auto_vacuum (convert) делает start_bot
+    # до запуска потоков: полный VACUUM держит базу целиком.
+    def __init__(self):
+        self._thread = None
+        self._event = threading.Event()
+
+    def prune(self):
+        if not FEEDCACHE_RETENTION:
+            return 0
+        cutoff = (datetime.now() - timedelta(seconds=FEEDCACHE_RETENTION)).isoformat()
+        removed = 0
+        for table, key in (("feedcache", "id"), ("deliveries", "rowid")):
+            while True:
+                with db_transaction() as c:
+                    c.execute(f"DELETE FROM {table} WHERE {key} IN (SELECT {key} FROM {table} WHERE timestamp < ? LIMIT ?)",
+                              (cutoff, DB_PRUNE_BATCH))
+                    batch = c.rowcount
+                removed += batch
+                if batch < DB_PRUNE_BATCH:
+                    break
+        if removed:
+            logger.info(f"Удалено старых строк feedcache и deliveries: {removed}")
+        return removed
+
+    def convert(self):
+        conn = get_db()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        # База создана без auto_vacuum: один полный VACUUM переводит её в инкрементальный режим
+        logger.info("Перевод базы в режим incremental auto_vacuum")
+        conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        with timed(sqlite_latency, "vacuum"):
+            conn.execute("VACUUM")
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return True
+
+    def vacuum(self):
+        conn = get_db()
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Ещё не переведена (например, загружена через /sqliteupdate): полный VACUUM
+            # из фонового потока заблокировал бы остальные, ждём перезапуска
+            logger.debug("incremental_vacuum пропущен: база не в режиме incremental auto_vacuum")
+            return
+        # Свободные страницы возвращаются порциями, чтобы не держать блокировку записи
+        initial = free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        while free:
+            with timed(sqlite_latency, "vacuum"):
+                conn.execute(f"PRAGMA incremental_vacuum({DB_VACUUM_PAGES})").fetchall()
+            remaining = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if remaining >= free:
+                break
+            free = remaining
+        if initial:
+            # После VACUUM и больших удалений WAL разрастается; сжимаем его вместе с базой
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            logger.info(f"Освобождено страниц базы: {initial - free}")
+
+    def analyze(self):
+        conn = get_db()
+        with timed(sqlite_latency, "analyze"):
+            conn.execute("PRAGMA analysis_limit=1000")
+            conn.execute("ANALYZE")
+
+    def run(self):
+        self.prune()
+        self.vacuum()
+        self.analyze()
+
+    def _run(self):
+        while True:
+            try:
+                self.run()
+            except Exception as e:
+                count_error(e)
+                logger.error(f"Ошибка обслуживания базы: {str(e)}")
+            self._event.wait(DB_MAINTENANCE_INTERVAL)
+            self._event.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="db-maintenance")
+            self._thread.start()
+
+db_maintenance = DbMaintenance()
+
 def log_error(message, link):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT INTO errors (timestamp, message, link) VALUES (?, ?, ?)", 
-              (datetime.now().isoformat(), message, link))
-    conn.commit()
-    if get_error_notifications():
-        c.execute("SELECT channel_id FROM channels")
-        channels = c.fetchall()
-        for (channel_id,) in channels:
-            send_message(channel_id, f"Ошибка: {message}\nСсылка: {link}", use_html=False)
-    conn.close()
-
-def get_article_content(url, max_attempts=3):
+    error_log.record(message, link)
+
+def llm_cache_key(url, prompt_template, model):
+    # Смена промпта или модели даёт новый ключ, старые записи уходят по TTL
+    prompt_hash = hashlib.sha256(prompt_template.encode()).hexdigest()
+    return hashlib.sha256(f"{canonicalize_url(url)}\n{prompt_hash}\n{model}".encode()).hexdigest()
+
+def get_cached_llm_result(key):
+    now = time.time()
+    result = db_fetchone("SELECT title, summary, created_at FROM llm_cache WHERE key = ?", (key,))
+    if not result or result[2] < now - LLM_CACHE_TTL:
+        return None
+    with db_transaction() as c:
+        c.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+    return result[0], result[1]
+
+def save_llm_result(key, url, title, summary, response):
+    now = time.time()
+    with db_transaction() as c:
+        c.execute("INSERT OR REPLACE INTO llm_cache (key, url, title, summary, response, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (key, url, title, summary, response, now, now))
+        c.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - LLM_CACHE_TTL,))
+        c.execute("""DELETE FROM llm_cache WHERE key IN (
+            SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)""", (LLM_CACHE_MAX_ROWS,))
+
+openai_client = None
+openai_client_lock = threading.Lock()
+
+def get_openai_client():
+    # Один клиент на процесс, чтобы переиспользовать HTTP-соединения.
+    # Повторы делает summarize_article, поэтому встроенные ретраи SDK отключены.
+    # OPENAI_BASE_URL из окружения SDK подхватывает сам.
+    global openai_client
+    with openai_client_lock:
+        if openai_client is None:
+            openai_client = OpenAI(api_key=OPENAI_API_KEY, timeout=LLM_TIMEOUT, max_retries=0)
+        return openai_client
+
+def llm_retry_delay(error, attempt):
+    response = getattr(error, "response", None)
+    if response is not None:
+        headers = response.headers
+        try:
+            if headers.get("retry-after-ms"):
+                return min(float(headers["retry-after-ms"]) / 1000, LLM_BACKOFF_MAX)
+            if headers.get("retry-after"):
+                return min(float(headers["retry-after"]), LLM_BACKOFF_MAX)
+        except ValueError:
+            pass
+    # Экспоненциальная задержка с полным джиттером
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+class SummaryService:
+    # Пул воркеров для запросов к LLM. Одновременные запросы одной и той же
+    # ссылки получают общий Future, очередь ограничена LLM_QUEUE_DEPTH.
+    def __init__(self, concurrency, queue_depth):
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="llm")
+        self._slots = threading.BoundedSemaphore(queue_depth)
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def submit(self, url, block=True, text=None):
+        key = canonicalize_url(url)
+        with self._lock:
+            future = self._in_flight.get(key)
+        if future:
+            llm_log.info(f"Запрос к LLM для {url} уже выполняется, ждём его результат")
+            return future
+        if not self._slots.acquire(blocking=block):
+            return None
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future:
+                self._slots.release()
+                return future
+            future = self._executor.submit(in_log_scope(summarize_article, link=url), url, text=text)
+            self._in_flight[key] = future
+        future.add_done_callback(lambda _: self._finish(key))
+        return future
+
+    def _finish(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        self._slots.release()
+
+    def submit_batch(self, urls, texts=None):
+        self._slots.acquire()
+        future = self._executor.submit(summarize_batch, urls, texts)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._in_flight)
+
+summary_service = SummaryService(LLM_CONCURRENCY, LLM_QUEUE_DEPTH)
+
+class ArticleExtractor(HTMLParser):
+    # Достаёт основной текст страницы: выкидывает скрипты, меню, подвалы, блоки
+    # «поделиться/похожие» и короткие строки, а при наличии <article>/<main>
+    # берёт только их содержимое.
+    SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form",
+                 "svg", "iframe", "button", "select", "template", "figure"}
+    BLOCK_TAGS = {"p", "div", "section", "article", "main", "li", "ul", "ol", "blockquote", "pre",
+                  "h1", "h2", "h3", "h4", "h5", "h6", "br", "tr", "td", "table", "dd", "dt"}
+    HEADING_TAGS = {"h1", "h2", "h3"}
+    MAIN_TAGS = {"article", "main"}
+    BOILERPLATE_RE = re.compile(r'(?:^|[\s_-])(?:comments?|share|sharing|social|related|promo|subscribe|newsletter|'
+                                r'ads?|advert\w*|cookies?|sidebar|footer|menu|breadcrumbs?|banner|popup|modal)(?:$|[\s_-])', re.I)
+
+    def __init__(self, strict=True, has_main=False):
+        super().__init__(convert_charrefs=True)
+        self.strict = strict
+        # Если на странице есть <article>/<main>, фильтр по классам работает только внутри:
+        # всё снаружи и так отбрасывается, а обёртки статьи бывают с «share» в классе
+        self.has_main = has_main
+        self.blocks = []
+        self._buffer = []
+        self._skip_tag = None
+        self._skip_depth = 0
+        self._main_depth = 0
+        self._heading = False
+
+    def handle_starttag(self, tag, attrs):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            return
+        marker = " ".join(value for name, value in attrs if name in ("class", "id", "role") and value)
+        boilerplate = (self.strict and marker and tag not in self.MAIN_TAGS
+                       and (self._main_depth or not self.has_main) and self.BOILERPLATE_RE.search(marker))
+        if tag in self.SKIP_TAGS or boilerplate:
+            if tag not in ("br", "img", "input", "hr", "meta", "link"):
+                self._flush()
+                self._skip_tag = tag
+                self._skip_depth = 1
+            return
+        if tag in self.BLOCK_TAGS:
+            self._flush()
+        if tag in self.MAIN_TAGS:
+            self._main_depth += 1
+        if tag in self.HEADING_TAGS:
+            self._heading = True
+
+    def handle_endtag(self, tag):
+        if self._skip_tag:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if not self._skip_depth:
+                    self._skip_tag = None
+            return
+        if tag in self.BLOCK_TAGS:
+            self._flush()
+        if tag in self.MAIN_TAGS and self._main_depth:
+            self._main_depth -= 1
+        if tag in self.HEADING_TAGS:
+            self._heading = False
+
+    def handle_data(self, data):
+        if not self._skip_tag:
+            self._buffer.append(data)
+
+    def _flush(self):
+        text = " ".join("".join(self._buffer).split())
+        self._buffer = []
+        if text and (len(text) >= ARTICLE_MIN_BLOCK or (self._heading and len(text) >= 15)):
+            self.blocks.append((text, self._main_depth > 0))
+
+    def text(self):
+        self._flush()
+        main = [text for text, in_main in self.blocks if in_main]
+        if sum(len(text) for text in main) < ARTICLE_MIN_BLOCK * 5:
+            main = [text for text, _ in self.blocks]
+        # Одинаковые строки (подписи, повторные заголовки) оставляем один раз
+        return "\n".join(dict.fromkeys(main))
+
+def extract_article_text(page, max_chars=ARTICLE_MAX_CHARS):
+    # Если фильтр по классам срезал почти всё, разбираем ещё раз без него
+    text = ""
+    has_main = "<article" in page or "<main" in page
+    for strict in (True, False):
+        extractor = ArticleExtractor(strict, has_main)
+        try:
+            extractor.feed(page)
+            extractor.close()
+        except Exception as e:
+            count_error(e)
+            llm_log.warning(f"Не удалось разобрать HTML статьи: {str(e)}")
+        text = extractor.text()
+        if len(text) >= ARTICLE_MIN_BLOCK * 5:
+            break
+    return truncate_text(text, max_chars)
+
+def truncate_text(text, max_chars):
+    # Обрезка по границе абзаца или предложения в пределах бюджета
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars]
+    boundary = max(cut.rfind("\n"), cut.rfind(". "))
+    return cut[:boundary + 1].rstrip() if boundary > max_chars // 2 else cut.rstrip() + "…"
+
+article_session = requests.Session()
+article_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=LLM_CONCURRENCY * 2))
+article_session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=LLM_CONCURRENCY * 2))
+article_session.headers["User-Agent"] = "Mozilla/5.0 (compatible; RSSNewsBot/1.0)"
+article_fetch_latency = register_metric(Histogram("bot_article_fetch_seconds", "Время загрузки и разбора статьи"))
+article_sources = register_metric(Counter("bot_article_text_total", "Откуда взят текст статьи для LLM", ("source",)))
+article_cache = OrderedDict()
+article_cache_lock = threading.Lock()
+
+def fetch_article_text(url):
+    # Текст статьи для промпта; пустая строка, если страницу получить не удалось
+    key = canonicalize_url(url)
+    with article_cache_lock:
+        if key in article_cache:
+            article_cache.move_to_end(key)
+            return article_cache[key]
+    try:
+        with timed(article_fetch_latency):
+            with article_session.get(url, timeout=ARTICLE_FETCH_TIMEOUT, stream=True) as response:
+                response.raise_for_status()
+                if "html" not in response.headers.get("Content-Type", "text/html"):
+                    raise ValueError(f"не HTML: {response.headers.get('Content-Type')}")
+                # iter_content, а не raw.read: ошибки urllib3 (таймаут чтения, обрыв,
+                # битый gzip) приходят обёрнутыми в requests.RequestException
+                body = b""
+                for chunk in response.iter_content(FEED_CHUNK_SIZE):
+                    body += chunk
+                    if len(body) >= ARTICLE_MAX_BYTES:
+                        body = body[:ARTICLE_MAX_BYTES]
+                        break
+            encoding = response.encoding if "charset" in response.headers.get("Content-Type", "") else None
+            text = extract_article_text(body.decode(encoding or "utf-8", errors="replace"))
+    except (requests.RequestException, ValueError) as e:
+        count_error(e)
+        llm_log.warning(f"Не удалось загрузить статью {url}: {str(e)}")
+        return ""
+    llm_log.info(f"Текст статьи получен: {len(text)} символов, {url}")
+    with article_cache_lock:
+        article_cache[key] = text
+        while len(article_cache) > ARTICLE_CACHE_SIZE:
+            article_cache.popitem(last=False)
+    return text
+
+def build_prompt(prompt_template, url, text):
+    # Старые промпты без {text} получают текст статьи в конце
+    article = text or "Текст статьи недоступен."
+    if "{text}" in prompt_template:
+        return prompt_template.format(url=url, text=article)
+    return prompt_template.format(url=url) + "\n\nТекст статьи:\n" + article
+
+def summarize_article(url, max_attempts=3, text=None):
     global last_llm_response
+    prompt_template = get_prompt()
+    model = get_model()
+    cache_key = llm_cache_key(url, prompt_template, model)
+    cached = get_cached_llm_result(cache_key)
+    if cached:
+        llm_log.debug("Ответ LLM взят из кэша для %s", url)
+        return cached
+
     if not OPENAI_API_KEY:
-        logger.error("OPENAI_API_KEY не задан")
+        llm_log.error("OPENAI_API_KEY не задан")
         log_error("OPENAI_API_KEY не задан", url)
         return "Ошибка: OPENAI_API_KEY не задан", "Ошибка: OPENAI_API_KEY не задан"
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
-    prompt = get_prompt().format(url=url)
-    model = get_model()
+    client = get_openai_client()
+    if text:
+        article_sources.inc("feed")
+    else:
+        article_sources.inc("fetch")
+        text = fetch_article_text(url)
+    prompt = build_prompt(prompt_template, url, text)
 
     for attempt in range(max_attempts):
-        logger.info(f"Запрос к OpenAI для {url}, попытка {attempt + 1}, модель: {model}")
+        llm_log.info(f"Запрос к OpenAI для {url}, попытка {attempt + 1}, модель: {model}")
         try:
-            response = client.chat.completions.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.7,
-                max_tokens=500
-            )
+            with timed(llm_latency, model, "single"):
+                response = client.chat.completions.create(
+                    model=model,
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.7,
+                    max_tokens=500
+                )
             content = response.choices[0].message.content.strip()
-            logger.info(f"Сырой ответ LLM: {content}")
+            llm_log.debug("Сырой ответ LLM: %s", content)
+            log_llm_usage(response, 1, model)
 
             # Сохраняем сырой ответ в глобальную переменную
             last_llm_response = {
@@ -249,120 +1436,230 @@ def get_article_content(url, max_attempts=3):
                     title = content
                     summary = "Пересказ не получен"
 
-            cleaned_title = clean_title(title)
-            if len(cleaned_title) > 100:
-                cleaned_title = cleaned_title[:97] + "..."
-                logger.warning(f"Заголовок укорочен: {cleaned_title}")
+            cleaned_title = shorten_title(clean_title(title))
             if is_valid_language(cleaned_title):
-                logger.info(f"Заголовок валиден после очистки: {cleaned_title}")
+                llm_log.debug("Заголовок валиден после очистки: %s", cleaned_title)
+                save_llm_result(cache_key, url, cleaned_title, summary, content)
                 return cleaned_title, summary
             else:
-                logger.warning(f"Недопустимый язык в заголовке после очистки: {cleaned_title}, перегенерация...")
+                llm_log.warning(f"Недопустимый язык в заголовке после очистки: {cleaned_title}, перегенерация...")
                 log_error(f"Недопустимый язык в заголовке: {cleaned_title}", url)
                 continue
         except Exception as e:
-            logger.error(f"Ошибка запроса к OpenAI: {str(e)}")
+            count_error(e)
+            llm_log.error(f"Ошибка запроса к OpenAI: {str(e)}")
             log_error(f"Ошибка запроса к OpenAI: {str(e)}", url)
-            if attempt == max_attempts - 1:
+            if attempt == max_attempts - 1 or isinstance(e, (AuthenticationError, BadRequestError, NotFoundError, PermissionDeniedError)):
                 return "Ошибка: Не удалось обработать новость после попыток", "Ошибка: Не удалось обработать новость"
-            time.sleep(1)
+            delay = llm_retry_delay(e, attempt)
+            llm_log.info(f"Повтор запроса к OpenAI через {delay:.1f} сек")
+            time.sleep(delay)
     return "Ошибка: Не удалось обработать новость после попыток", "Ошибка: Не удалось обработать новость"
 
+BATCH_PROMPT_SUFFIX = """
+Обработай так каждую статью из списка ниже (ссылка и текст) независимо от остальных:
+{urls}
+
+Верни JSON-объект вида {{"items": [{{"url": "<ссылка из списка>", "title": "<заголовок>", "summary": "<пересказ>"}}]}} с одним элементом на каждую ссылку, без текста вне JSON.
+"""
+
+def log_llm_usage(response, articles, model):
+    usage = getattr(response, "usage", None)
+    if usage:
+        llm_tokens.inc(model, "prompt", amount=usage.prompt_tokens)
+        llm_tokens.inc(model, "completion", amount=usage.completion_tokens)
+        llm_log.info(f"Токены LLM: prompt {usage.prompt_tokens}, completion {usage.completion_tokens}, "
+                    f"на статью {usage.total_tokens / articles:.0f}")
+
+def summarize_batch(urls, texts=None):
+    # Несколько статей одним запросом со структурированным ответом.
+    # Возвращает только прошедшие валидацию результаты, остальное уходит в одиночные запросы.
+    global last_llm_response
+    prompt_template = get_prompt()
+    model = get_model()
+    results = {}
+    pending = {}
+    for url in urls:
+        cache_key = llm_cache_key(url, prompt_template, model)
+        cached = get_cached_llm_result(cache_key)
+        if cached:
+            results[url] = cached
+        else:
+            pending[canonicalize_url(url)] = (url, cache_key)
+    if len(pending) < 2 or not OPENAI_API_KEY:
+        return results
+
+    # Бюджет текста делится между статьями пакета
+    budget = max(ARTICLE_MAX_CHARS // len(pending), ARTICLE_MAX_CHARS // 4)
+    texts = texts or {}
+    for url, _ in pending.values():
+        article_sources.inc("feed" if texts.get(url) else "fetch")
+    url_list = "\n\n".join(f"{i + 1}. {url}\n{truncate_text(texts.get(url) or fetch_article_text(url), budget) or 'Текст статьи недоступен.'}"
+                           for i, (url, _) in enumerate(pending.values()))
+    prompt = build_prompt(prompt_template, "из списка ниже", "приведён ниже под каждой ссылкой") + BATCH_PROMPT_SUFFIX.format(urls=url_list)
+    llm_log.info(f"Пакетный запрос к OpenAI для {len(pending)} ссылок, модель: {model}")
+    try:
+        with timed(llm_latency, model, "batch"):
+            response = get_openai_client().chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                max_tokens=300 * len(pending),
+                response_format={"type": "json_object"}
+            )
+        content = response.choices[0].message.content.strip()
+        items = json.loads(content).get("items", [])
+    except Exception as e:
+        count_error(e)
+        llm_log.error(f"Ошибка пакетного запроса к OpenAI: {str(e)}")
+        log_error(f"Ошибка пакетного запроса к OpenAI: {str(e)}", ", ".join(url for url, _ in pending.values()))
+        return results
+    log_llm_usage(response, len(pending), model)
+    last_llm_response = {
+        "response": content,
+        "link": ", ".join(url for url, _ in pending.values()),
+        "timestamp": datetime.now().isoformat()
+    }
+
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        match = pending.get(canonicalize_url(str(item.get("url", ""))))
+        title = shorten_title(clean_title(str(item.get("title", ""))))
+        summary = str(item.get("summary", "")).strip()
+        if not match or not title or not summary or not is_valid_language(title):
+            llm_log.warning(f"Элемент пакетного ответа не прошёл проверку: {item}")
+            continue
+        url, cache_key = match
+        save_llm_result(cache_key, url, title, summary, json.dumps(item, ensure_ascii=False))
+        results[url] = (title, summary)
+    llm_log.info(f"Пакетный ответ: принято {len(results)} из {len(urls)}")
+    return results
+
 def save_to_feedcache(title, summary, link, source):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    link_hash = hashlib.md5(link.encode()).hexdigest()
+    link_hash = link_id(link)
     entry = (link_hash, title, summary, link, source, datetime.now().isoformat())
     try:
-        c.execute("INSERT OR REPLACE INTO feedcache (id, title, summary, link, source, timestamp) VALUES (?, ?, ?, ?, ?, ?)", entry)
-        conn.commit()
-        logger.info(f"Сохранено в feedcache: {link_hash} для {link}")
+        with db_transaction() as c:
+            c.execute("INSERT OR REPLACE INTO feedcache (id, title, summary, link, source, timestamp) VALUES (?, ?, ?, ?, ?, ?)", entry)
+            c.execute("INSERT OR IGNORE INTO seen_links (key) VALUES (?)", (DedupIndex.key_for_link(link),))
+        dedup_index.add(link)
+        feed_log.info(f"Сохранено в feedcache: {link_hash} для {link}")
     except sqlite3.Error as e:
-        logger.error(f"Ошибка записи в feedcache: {str(e)}")
-    finally:
-        conn.close()
+        feed_log.error(f"Ошибка записи в feedcache: {str(e)}")
 
 def check_duplicate(link):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    link_hash = hashlib.md5(link.encode()).hexdigest()
-    c.execute("SELECT id FROM feedcache WHERE id = ?", (link_hash,))
-    result = c.fetchone()
-    conn.close()
-    if result:
-        logger.info(f"Найден дубль в feedcache: {link_hash} для {link}")
+    if link in dedup_index:
+        feed_log.debug("Найден дубль в feedcache: %s", link)
+        return True
+    feed_log.debug("Дубль не найден: %s", link, extra=SAMPLED)
+    return False
+
+def check_duplicates(links):
+    # Пакетная проверка всех записей ленты, возвращает множество дублей
+    return dedup_index.find_duplicates(links)
+
+def check_near_duplicate(candidate):
+    signature = near_dup_index.signature(candidate.get("text", ""))
+    candidate["signature"] = signature
+    if signature is None:
+        return False
+    # Своя временная запись (пост уже в очереди готовых) дублем не считается
+    match = near_dup_index.find(signature, exclude=link_id(candidate["link"]))
+    if match:
+        feed_log.info(f"Похожая новость уже была ({match[0]}, сходство {match[1]:.2f}): {candidate['link']}")
         return True
-    logger.info(f"Дубль не найден: {link_hash} для {link}")
     return False
 
+def remember_story(candidate):
+    if candidate.get("signature"):
+        near_dup_index.remember(link_id(candidate["link"]), candidate["signature"])
+
+def hold_story(candidate):
+    # Пока кандидат пересказывается и ждёт постинга, похожие на него не берутся в работу
+    if candidate.get("signature"):
+        near_dup_index.hold(link_id(candidate["link"]), candidate["signature"])
+
+def release_story(candidate):
+    near_dup_index.release(link_id(candidate["link"]))
+
+admin_channels = {}
+
+def load_admin_channels():
+    # Карта admin -> канал в памяти; перечитывается после каждой записи в admins/channels
+    global admin_channels
+    mapping = {}
+    for username, channel_id in db_fetchall("SELECT username, channel_id FROM admins"):
+        mapping.setdefault(username, channel_id)
+    admin_channels = mapping
+
 def get_channel_by_admin(username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT channel_id FROM admins WHERE username = ?", (username,))
-    result = c.fetchone()
-    conn.close()
-    return result[0] if result else None
+    return admin_channels.get(username)
 
 def get_channel_creator(channel_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT creator_username FROM channels WHERE channel_id = ?", (channel_id,))
-    result = c.fetchone()
-    conn.close()
+    result = db_fetchone("SELECT creator_username FROM channels WHERE channel_id = ?", (channel_id,))
     return result[0] if result else None
 
+def get_channels():
+    return [row[0] for row in db_fetchall("SELECT channel_id FROM channels")]
+
 def save_channel(channel_id, creator_username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("INSERT OR IGNORE INTO channels (channel_id, creator_username) VALUES (?, ?)", (channel_id, creator_username))
-    c.execute("INSERT OR IGNORE INTO admins (channel_id, username) VALUES (?, ?)", (channel_id, creator_username))
-    conn.commit()
-    conn.close()
+    with db_transaction() as c:
+        c.execute("INSERT OR IGNORE INTO channels (channel_id, creator_username) VALUES (?, ?)", (channel_id, creator_username))
+        c.execute("INSERT OR IGNORE INTO admins (channel_id, username) VALUES (?, ?)", (channel_id, creator_username))
+    load_admin_channels()
 
 def add_admin(channel_id, new_admin_username, requester_username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT username FROM admins WHERE channel_id = ? AND username = ?", (channel_id, requester_username))
-    if c.fetchone():
-        c.execute("INSERT OR IGNORE INTO admins (channel_id, username) VALUES (?, ?)", (channel_id, new_admin_username))
-        conn.commit()
-        conn.close()
-        return True
-    conn.close()
-    return False
+    with db_transaction() as c:
+        c.execute("SELECT username FROM admins WHERE channel_id = ? AND username = ?", (channel_id, requester_username))
+        added = c.fetchone() is not None
+        if added:
+            c.execute("INSERT OR IGNORE INTO admins (channel_id, username) VALUES (?, ?)", (channel_id, new_admin_username))
+    if added:
+        load_admin_channels()
+    return added
 
-def remove_admin(channel_id, admin_username348, requester_username):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT username FROM admins WHERE channel_id = ? AND username = ?", (channel_id, requester_username))
-    if c.fetchone():
-        creator = get_channel_creator(channel_id)
-        if admin_username == creator:
-            conn.close()
+def remove_admin(channel_id, admin_username, requester_username):
+    with db_transaction() as c:
+        c.execute("SELECT username FROM admins WHERE channel_id = ? AND username = ?", (channel_id, requester_username))
+        if not c.fetchone() or admin_username == get_channel_creator(channel_id):
             return False
         c.execute("DELETE FROM admins WHERE channel_id = ? AND username = ?", (channel_id, admin_username))
-        conn.commit()
-        conn.close()
-        return True
-    conn.close()
-    return False
+    load_admin_channels()
+    return True
 
 def get_admins(channel_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute("SELECT username FROM admins WHERE channel_id = ?", (channel_id,))
-    result = c.fetchall()
-    conn.close()
-    return [row[0] for row in result]
+    return [row[0] for row in db_fetchall("SELECT username FROM admins WHERE channel_id = ?", (channel_id,))]
+
+def get_bot_user_id():
+    global bot_user_id
+    if bot_user_id is None:
+        bot_user_id = telegram_request("getMe", http_method="GET").json()["result"]["id"]
+        logger.info(f"ID бота: {bot_user_id}")
+    return bot_user_id
+
+def invalidate_channel_rights(channel_id):
+    with channel_rights_lock:
+        if channel_rights.pop(channel_id, None):
+            logger.info(f"Кэш прав сброшен для {channel_id}")
 
 def can_post_to_channel(channel_id):
-    response = requests.get(f"{TELEGRAM_URL}getChatMember", params={
+    # Кэшируются только подтверждённые права: отказ перепроверяется при следующем вызове
+    with channel_rights_lock:
+        checked_at = channel_rights.get(channel_id)
+    if checked_at and time.time() - checked_at < CHANNEL_RIGHTS_TTL:
+        return True
+    response = telegram_request("getChatMember", http_method="GET", params={
         "chat_id": channel_id,
-        "user_id": requests.get(f"{TELEGRAM_URL}getMe").json()["result"]["id"]
+        "user_id": get_bot_user_id()
     })
     if response.status_code == 200:
         status = response.json()["result"]["status"]
-        return status in ["administrator", "creator"]
+        if status in ["administrator", "creator"]:
+            with channel_rights_lock:
+                channel_rights[channel_id] = time.time()
+            return True
+        return False
     logger.error(f"Ошибка проверки прав для {channel_id}: {response.text}")
     return False
 
@@ -377,111 +1674,911 @@ def parse_interval(interval_str):
             total_seconds += value * 60
     return total_seconds if total_seconds > 0 else None
 
-def post_news():
-    global current_index, posting_active, post_count, error_count, duplicate_count, last_post_time
-    while posting_active:
-        logger.info(f"Начало цикла постинга, posting_active={posting_active}")
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT channel_id FROM channels")
-        channels = c.fetchall()
-        conn.close()
-
-        if not channels:
-            logger.info("Нет каналов для постинга")
-            next_post_event.wait(posting_interval)
-            if not posting_active:
-                break
+def get_feed_validators(rss_url):
+    result = db_fetchone("SELECT etag, last_modified, body_hash FROM feed_validators WHERE url = ?", (rss_url,))
+    return result if result else (None, None, None)
+
+def save_feed_validators(rss_url, etag, last_modified, body_hash):
+    with db_transaction() as c:
+        c.execute("INSERT OR REPLACE INTO feed_validators (url, etag, last_modified, body_hash, timestamp) VALUES (?, ?, ?, ?, ?)",
+                  (rss_url, etag, last_modified, body_hash, datetime.now().isoformat()))
+
+class FeedRegistry:
+    # Ленты из таблицы feeds в памяти. Каждая опрашивается по своему интервалу:
+    # ~одна новая запись за опрос для активных лент, удвоение интервала для
+    # тихих и экспоненциальная задержка для падающих. Выключенные не опрашиваются.
+    COLUMNS = ("url", "source", "enabled", "added_at", "poll_interval", "next_poll", "last_polled",
+               "last_new_item", "items_per_day", "error_streak", "last_error")
+
+    def __init__(self):
+        self._feeds = {}
+        self._lock = threading.Lock()
+
+    def load(self):
+        rows = db_fetchall(f"SELECT {', '.join(self.COLUMNS)} FROM feeds")
+        with self._lock:
+            self._feeds = {row[0]: dict(zip(self.COLUMNS, row)) for row in rows}
+        feed_log.info(f"Ленты загружены: {len(rows)}, включено: {sum(1 for row in rows if row[2])}")
+
+    def _save(self, feed):
+        with db_transaction() as c:
+            c.execute(f"INSERT OR REPLACE INTO feeds ({', '.join(self.COLUMNS)}) VALUES ({', '.join('?' * len(self.COLUMNS))})",
+                      tuple(feed[column] for column in self.COLUMNS))
+
+    def _update(self, url, **changes):
+        with self._lock:
+            feed = self._feeds.get(url)
+            if feed is None:
+                return None
+            feed.update(changes)
+            feed = dict(feed)
+        self._save(feed)
+        return feed
+
+    def all(self):
+        with self._lock:
+            return [dict(feed) for feed in self._feeds.values()]
+
+    def enabled_urls(self):
+        with self._lock:
+            return [url for url, feed in self._feeds.items() if feed["enabled"]]
+
+    def sources(self):
+        with self._lock:
+            return sorted({feed["source"] for feed in self._feeds.values()})
+
+    def find(self, query):
+        # По точному URL или по домену источника (theverge.com, 9to5mac)
+        query = query.strip()
+        with self._lock:
+            if query in self._feeds:
+                return [query]
+            query = query.lower()
+            return [url for url, feed in self._feeds.items()
+                    if feed["source"] == query or feed["source"].endswith("." + query) or feed["source"].split(".")[0] == query]
+
+    def add(self, url):
+        feed = {column: None for column in self.COLUMNS}
+        feed.update(url=url, source=url.split('/')[2], enabled=1, added_at=time.time(),
+                    poll_interval=PREGEN_INTERVAL, next_poll=0, error_streak=0)
+        with self._lock:
+            if url in self._feeds:
+                return False
+            self._feeds[url] = feed
+        self._save(feed)
+        return True
+
+    def remove(self, url):
+        with self._lock:
+            removed = self._feeds.pop(url, None)
+        if removed:
+            with db_transaction() as c:
+                c.execute("DELETE FROM feeds WHERE url = ?", (url,))
+                c.execute("DELETE FROM feed_validators WHERE url = ?", (url,))
+        return removed is not None
+
+    def set_enabled(self, url, enabled):
+        return self._update(url, enabled=int(enabled), next_poll=0)
+
+    def poll_all_now(self):
+        # После старта все включённые ленты опрашиваются сразу, не дожидаясь сохранённого next_poll
+        with self._lock:
+            for feed in self._feeds.values():
+                feed["next_poll"] = 0
+
+    def due(self, now=None):
+        now = now or time.time()
+        with self._lock:
+            return [url for url, feed in self._feeds.items() if feed["enabled"] and (feed["next_poll"] or 0) <= now]
+
+    def next_due(self):
+        with self._lock:
+            return min((feed["next_poll"] or 0 for feed in self._feeds.values() if feed["enabled"]), default=None)
+
+    @staticmethod
+    def _clamp(interval):
+        return min(FEED_POLL_MAX, max(FEED_POLL_MIN, interval))
+
+    def record_success(self, url, published):
+        # published — времена публикации записей ленты (None, если лента не изменилась)
+        now = time.time()
+        with self._lock:
+            feed = self._feeds.get(url)
+            if feed is None:
+                return
+            dated = sorted(timestamp for timestamp in published or [] if timestamp)
+            if len(dated) >= 2 and dated[-1] > dated[0]:
+                window_rate = (len(dated) - 1) * 86400 / (dated[-1] - dated[0])
+                previous = feed["items_per_day"]
+                feed["items_per_day"] = window_rate if previous is None else (previous + window_rate) / 2
+            expected = 86400 / feed["items_per_day"] if feed["items_per_day"] else PREGEN_INTERVAL
+            if dated and dated[-1] > (feed["last_new_item"] or 0):
+                feed["last_new_item"] = dated[-1]
+                interval = expected
+            elif published and not dated:
+                # Лента изменилась, но записи без дат — оставляем интервал как есть
+                interval = feed["poll_interval"] or expected
+            else:
+                # Новых записей нет: удваиваем интервал, но не дальше 4 ожидаемых промежутков
+                interval = min((feed["poll_interval"] or expected) * 2, max(expected * 4, FEED_POLL_MIN * 2))
+            feed.update(poll_interval=self._clamp(interval), last_polled=now, error_streak=0, last_error=None)
+            feed["next_poll"] = now + feed["poll_interval"]
+            feed = dict(feed)
+        self._save(feed)
+
+    def record_error(self, url, error):
+        now = time.time()
+        with self._lock:
+            feed = self._feeds.get(url)
+            if feed is None:
+                return
+            feed["error_streak"] = (feed["error_streak"] or 0) + 1
+            feed.update(poll_interval=self._clamp(FEED_POLL_MIN * 2 ** feed["error_streak"]),
+                        last_polled=now, last_error=str(error)[:200])
+            feed["next_poll"] = now + feed["poll_interval"]
+            feed = dict(feed)
+        self._save(feed)
+
+feed_registry = FeedRegistry()
+
+def count_feed_cache(hit):
+    global feed_cache_hits, feed_cache_misses
+    with feed_stats_lock:
+        if hit:
+            feed_cache_hits += 1
+        else:
+            feed_cache_misses += 1
+
+def fetch_feed(rss_url):
+    # Возвращает (записи, валидаторы). Записи — None, если лента не изменилась с прошлой
+    # загрузки; валидаторы — (etag, last_modified, хэш) для сохранения или None. Сохраняет
+    # их fetch_all_feeds, когда результат принят: опоздавшая загрузка не должна пометить
+    # ленту прочитанной, раз её записи выброшены.
+    # Очередь кандидатов живёт только в памяти, поэтому первая загрузка ленты после
+    # старта идёт без If-None-Match/If-Modified-Since и сравнения хэша: иначе 304
+    # и совпавший хэш оставили бы очередь пустой до появления новых записей
+    if rss_url in fetched_feeds:
+        etag, last_modified, body_hash = get_feed_validators(rss_url)
+    else:
+        etag = last_modified = body_hash = None
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    source = rss_url.split('/')[2]
+    deadline = time.monotonic() + FEED_TIMEOUT
+    with timed(feed_fetch_latency, source):
+        response = requests.get(rss_url, headers=headers, timeout=FEED_TIMEOUT, stream=True)
+        streamed = FEED_STREAMING and 200 <= response.status_code < 300
+        if not streamed:
+            # Без потокового разбора тело дочитывается сразу, в пределах общего срока
+            try:
+                content = b"".join(feed_chunks(rss_url, response, deadline))
+            finally:
+                response.close()
+    if response.status_code == 304:
+        count_feed_cache(True)
+        feed_log.debug("RSS не изменился (304): %s", rss_url)
+        return None, None
+    if streamed:
+        return read_feed_stream(rss_url, response, source, (etag, last_modified, body_hash), deadline)
+    response.raise_for_status()
+    new_hash = hashlib.md5(content).hexdigest()
+    new_etag = response.headers.get("ETag")
+    new_last_modified = response.headers.get("Last-Modified")
+    if new_hash == body_hash:
+        count_feed_cache(True)
+        feed_log.debug("RSS не изменился (хэш совпал): %s", rss_url)
+        return None, (new_etag, new_last_modified, new_hash)
+    count_feed_cache(False)
+    with timed(feed_parse_latency, source):
+        entries = feedparser.parse(content).entries
+    return entries, (new_etag, new_last_modified, new_hash)
+
+RSS_CONTENT = "{http://purl.org/rss/1.0/modules/content/}encoded"
+RSS_FEEDBURNER = "{http://rssnamespace.org/feedburner/ext/1.0}origLink"
+RSS_DC_DATE = "{http://purl.org/dc/elements/1.1/}date"
+RDF_ABOUT = "{http://www.w3.org/1999/02/22-rdf-syntax-ns#}about"
+ATOM = "{http://www.w3.org/2005/Atom}"
+ENTRY_TAGS = {"item", "{http://purl.org/rss/1.0/}item", ATOM + "entry"}
+
+def parse_feed_date(value):
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        return time.gmtime(calendar.timegm(parsed.timetuple()))
+    return time.gmtime(parsed.timestamp())
+
+def xml_child_text(elem, *tags):
+    for tag in tags:
+        child = elem.find(tag)
+        if child is not None:
+            return "".join(child.itertext()).strip()
+    return ""
+
+def stream_entry(elem):
+    # Запись RSS 2.0 / RSS 1.0 / Atom в том же виде, что отдаёт feedparser
+    if elem.tag == ATOM + "entry":
+        link = next((node.get("href") for node in elem.findall(ATOM + "link")
+                     if node.get("rel", "alternate") == "alternate" and node.get("href")), "")
+        entry = feedparser.FeedParserDict(
+            title=xml_child_text(elem, ATOM + "title"),
+            link=link,
+            id=xml_child_text(elem, ATOM + "id"),
+            summary=xml_child_text(elem, ATOM + "summary"),
+            published_parsed=parse_feed_date(xml_child_text(elem, ATOM + "published", ATOM + "updated")),
+        )
+        content = xml_child_text(elem, ATOM + "content")
+    else:
+        namespace = elem.tag[:-len("item")]
+        entry = feedparser.FeedParserDict(
+            title=xml_child_text(elem, namespace + "title"),
+            link=xml_child_text(elem, namespace + "link"),
+            id=xml_child_text(elem, "guid") or elem.get(RDF_ABOUT, ""),
+            summary=xml_child_text(elem, namespace + "description"),
+            published_parsed=parse_feed_date(xml_child_text(elem, "pubDate", RSS_DC_DATE)),
+        )
+        content = xml_child_text(elem, RSS_CONTENT)
+        origlink = xml_child_text(elem, RSS_FEEDBURNER)
+        if origlink:
+            entry["feedburner_origlink"] = origlink
+    if content:
+        entry["content"] = [feedparser.FeedParserDict(value=content, type="text/html")]
+    if not entry["id"]:
+        # Как у feedparser: без guid/id ключа нет совсем
+        del entry["id"]
+    return entry if entry.get("link") else None
+
+def stream_feed_entries(chunks, is_seen=None):
+    # Отдаёт записи по мере чтения и сразу освобождает их XML-узлы.
+    # Останавливается на первой записи, для которой is_seen(link) истинно:
+    # ленты идут от новых к старым, дальше только уже обработанное.
+    parser = ET.XMLPullParser(events=("end",))
+    for chunk in chunks:
+        parser.feed(chunk)
+        for _, elem in parser.read_events():
+            if elem.tag not in ENTRY_TAGS:
+                continue
+            entry = stream_entry(elem)
+            elem.clear()
+            if entry is None:
+                continue
+            if is_seen and is_seen(entry.get("feedburner_origlink") or entry.link):
+                return
+            yield entry
+
+def feed_chunks(rss_url, response, deadline):
+    # Лента, которая шлёт байты без конца, не упирается в per-read таймаут requests и
+    # держала бы поток feed_executor вечно, поэтому после каждого чтения проверяется
+    # общий срок. iter_content ждёт полного куска, read1 отдаёт то, что уже пришло
+    while True:
+        try:
+            chunk = response.raw.read1(FEED_CHUNK_SIZE, decode_content=True)
+        except urllib3.exceptions.HTTPError as e:
+            # read1 идёт мимо обёртки requests: ошибки urllib3 приводим к RequestException
+            raise requests.ConnectionError(e)
+        if not chunk:
+            return
+        if time.monotonic() > deadline:
+            raise requests.Timeout(f"RSS {rss_url} не загружен за {FEED_TIMEOUT} с")
+        yield chunk
+
+def read_feed_stream(rss_url, response, source, validators, deadline):
+    # Хэш считается по прочитанной части: если начало ленты не изменилось,
+    # чтение остановится в том же месте и хэш совпадёт
+    etag, last_modified, body_hash = validators
+    digest = hashlib.md5()
+    received = []
+
+    def chunks():
+        size = 0
+        for chunk in feed_chunks(rss_url, response, deadline):
+            chunk = chunk[:FEED_MAX_BYTES - size]
+            size += len(chunk)
+            digest.update(chunk)
+            received.append(chunk)
+            yield chunk
+            if size >= FEED_MAX_BYTES:
+                feed_log.debug("RSS %s обрезан на %d КБ", rss_url, FEED_MAX_BYTES // 1024)
+                return
+
+    stream = chunks()
+    with timed(feed_parse_latency, source):
+        try:
+            entries = list(stream_feed_entries(stream, lambda link: link in dedup_index))
+        except ET.ParseError as e:
+            # Невалидный XML (HTML-сущности, мусор в начале) — дочитываем и отдаём feedparser'у
+            feed_log.debug("Потоковый разбор %s не удался (%s), используем feedparser", rss_url, e)
+            for _ in stream:
+                pass
+            entries = feedparser.parse(b"".join(received)).entries
+        finally:
+            response.close()
+    new_hash = digest.hexdigest()
+    new_etag = response.headers.get("ETag")
+    new_last_modified = response.headers.get("Last-Modified")
+    if new_hash == body_hash or not entries:
+        count_feed_cache(True)
+        feed_log.debug("RSS без новых записей: %s", rss_url)
+        return None, (new_etag, new_last_modified, new_hash)
+    count_feed_cache(False)
+    return entries, (new_etag, new_last_modified, new_hash)
+
+def probe_feed(rss_url):
+    # Пробная загрузка перед добавлением ленты; валидаторы не сохраняются,
+    # чтобы первый настоящий опрос забрал все записи
+    response = requests.get(rss_url, timeout=FEED_TIMEOUT)
+    response.raise_for_status()
+    return feedparser.parse(response.content).entries
+
+def fetch_all_feeds():
+    global error_count
+    # Параллельно качаются только ленты, у которых подошло время опроса; время цикла
+    # определяется самой медленной из них. Ленты с ошибкой в результат не попадают.
+    futures = {feed_executor.submit(fetch_feed, rss_url): rss_url for rss_url in feed_registry.due()}
+    if not futures:
+        return {}
+    done, not_done = wait(futures, timeout=FEED_TIMEOUT * 2)
+    results = {}
+    for future in done:
+        rss_url = futures[future]
+        try:
+            entries, validators = future.result()
+        except Exception as e:
+            count_error(e)
+            feed_log.error(f"Ошибка загрузки RSS {rss_url}: {str(e)}")
+            feed_registry.record_error(rss_url, e)
+            error_count += 1
             continue
+        results[rss_url] = entries
+        fetched_feeds.add(rss_url)
+        if validators and validators != get_feed_validators(rss_url):
+            save_feed_validators(rss_url, *validators)
+    for future in not_done:
+        rss_url = futures[future]
+        feed_log.error(f"Таймаут загрузки RSS {rss_url}")
+        feed_registry.record_error(rss_url, "таймаут")
+        error_count += 1
+    return results
 
-        rss_url = RSS_URLS[current_index]
-        logger.info(f"Обрабатываем RSS: {rss_url}")
-        feed = feedparser.parse(rss_url)
+def entry_published(entry, fallback):
+    parsed = entry.get("published_parsed") or entry.get("updated_parsed")
+    if parsed:
+        try:
+            return calendar.timegm(parsed)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return fallback
+
+def make_candidate(entry, source, published):
+    # Кандидат из записи feedparser. feed_text заполняется, только если анонс или
+    # полный текст в ленте достаточно длинные, чтобы пересказывать без загрузки статьи.
+    link = entry.get("feedburner_origlink") or entry.link
+    title = strip_html(entry.get("title", "")).strip()
+    summary = " ".join(strip_html(entry.get("summary", "")).split())
+    content = max((extract_article_text(part.get("value", "")) for part in entry.get("content", [])), key=len, default="")
+    body = content if len(content) >= len(summary) else summary
+    return {
+        "link": link,
+        "guid": entry.get("id") or link,
+        "source": source,
+        "feed_title": title,
+        "feed_summary": summary,
+        "published": published,
+        "text": f"{title} {summary}",
+        "feed_text": truncate_text(f"{title}\n{body}", ARTICLE_MAX_CHARS) if len(body) >= FEED_TEXT_MIN_CHARS else None,
+    }
 
-        if not feed.entries:
-            logger.warning(f"Нет записей в {rss_url}")
+def refresh_candidates():
+    global error_count, duplicate_count
+    results = fetch_all_feeds()
+    fetched_at = time.time()
+    fresh = []
+    for rss_url, entries in results.items():
+        if entries is None:
+            feed_registry.record_success(rss_url, None)
+            continue
+        if not entries:
+            feed_log.warning(f"Нет записей в {rss_url}")
             error_count += 1
+            feed_registry.record_error(rss_url, "нет записей")
+            continue
+        feed_registry.record_success(rss_url, [entry_published(entry, None) for entry in entries])
+        source = rss_url.split('/')[2]
+        # Записи без даты датируются временем загрузки и сохраняют порядок ленты
+        newest = sorted(((entry_published(entry, fetched_at - index), entry) for index, entry in enumerate(entries)
+                         if entry.get("link")), key=lambda pair: -pair[0])[:FEED_ENTRIES_LIMIT]
+        candidates = [make_candidate(entry, source, published) for published, entry in newest]
+        duplicates = check_duplicates([candidate["link"] for candidate in candidates])
+        duplicate_count += len(duplicates)
+        fresh += [candidate for candidate in candidates if candidate["link"] not in duplicates]
+
+    # Очередь кандидатов общая для всех лент и упорядочена по времени публикации
+    added = 0
+    with candidate_lock:
+        merged = list(candidate_queue)
+        known = {canonicalize_url(candidate["link"]) for candidate in merged} | {candidate["guid"] for candidate in merged}
+        for candidate in fresh:
+            canonical = canonicalize_url(candidate["link"])
+            if canonical in known or candidate["guid"] in known:
+                continue
+            merged.append(candidate)
+            known.update((canonical, candidate["guid"]))
+            added += 1
+        merged.sort(key=lambda candidate: -candidate["published"])
+        candidate_queue.clear()
+        candidate_queue.extend(merged[:CANDIDATE_QUEUE_SIZE])
+        feed_log.info(f"Добавлено кандидатов: {added}, в очереди: {len(candidate_queue)}")
+
+def next_candidate(sources=None):
+    global duplicate_count
+    while True:
+        with candidate_lock:
+            candidate = next((candidate for candidate in candidate_queue
+                              if not sources or candidate["source"] in sources), None)
+            if candidate is None:
+                return None
+            candidate_queue.remove(candidate)
+        feed_log.debug("Проверяем ссылку: %s", candidate['link'], extra=SAMPLED)
+        if not check_duplicate(candidate["link"]) and not check_near_duplicate(candidate):
+            hold_story(candidate)
+            return candidate
+        duplicate_count += 1
+        feed_log.info(f"Дубль пропущен: {candidate['link']}, общее число дублей: {duplicate_count}")
+
+def skip_current_source():
+    with candidate_lock:
+        if not candidate_queue:
+            return None
+        source = candidate_queue[0]["source"]
+        remaining = [candidate for candidate in candidate_queue if candidate["source"] != source]
+        candidate_queue.clear()
+        candidate_queue.extend(remaining)
+        return source
+
+def current_source():
+    with candidate_lock:
+        return candidate_queue[0]["source"] if candidate_queue else None
+
+def discard_ready_items(items):
+    ids = {id(item) for item in items}
+    with ready_lock:
+        remaining = [item for item in ready_queue if id(item) not in ids]
+        ready_queue.clear()
+        ready_queue.extend(remaining)
+    for item in items:
+        release_story(item)
+
+def prune_ready_queue():
+    # Удаляет устаревшие посты и посты, уже доставленные во все подходящие каналы
+    now = time.time()
+    with ready_lock:
+        items = list(ready_queue)
+    stale = [item for item in items if now - item["ready_at"] > READY_MAX_AGE]
+    done = [item for item in items if item["posted"] and item not in stale
+            and not scheduler.channels_for_source(item["source"]) - item["delivered"]]
+    if stale or done:
+        discard_ready_items(stale + done)
+    if stale:
+        logger.info(f"Отброшено устаревших готовых постов: {len(stale)}")
+
+def unposted_ready_items():
+    with ready_lock:
+        return [item for item in ready_queue if not item["posted"]]
+
+def fill_ready_queue():
+    # Заранее генерирует пересказы, чтобы к моменту постинга оставалось только отправить
+    global error_count
+    prune_ready_queue()
+    refresh_candidates()
+    starving = starving_feed_sets()
+    free = READY_QUEUE_DEPTH - len(unposted_ready_items())
+    if free <= 0 and not starving:
+        if READY_DISCARD_POLICY != "oldest" or not current_source():
+            return
+        # Очередь полна, но есть свежие кандидаты: вытесняем самый старый готовый пост
+        dropped = unposted_ready_items()[0]
+        discard_ready_items([dropped])
+        logger.info(f"Готовый пост вытеснен более свежим кандидатом: {dropped['link']}")
+        free = 1
+
+    candidates = []
+    # Сначала по кандидату для каналов, которым из готовых постов сейчас нечего отправить
+    for feeds in starving:
+        if any(candidate["source"] in feeds for candidate in candidates):
+            continue
+        candidate = next_candidate(feeds)
+        if candidate:
+            candidates.append(candidate)
+    while len(candidates) < free:
+        candidate = next_candidate()
+        if not candidate:
+            break
+        candidates.append(candidate)
+
+    batched = {}
+    if LLM_BATCH_SIZE > 1 and len(candidates) > 1:
+        texts = {candidate["link"]: candidate["feed_text"] for candidate in candidates if candidate.get("feed_text")}
+        batches = [summary_service.submit_batch([candidate["link"] for candidate in candidates[i:i + LLM_BATCH_SIZE]], texts)
+                   for i in range(0, len(candidates), LLM_BATCH_SIZE)]
+        for future in batches:
+            try:
+                batched.update(future.result())
+            except Exception as e:
+                # Кандидаты упавшего пакета уйдут одиночными запросами ниже
+                count_error(e)
+                llm_log.error(f"Ошибка пакетного запроса к LLM: {str(e)}")
+
+    pending = []
+    for candidate in candidates:
+        if candidate["link"] in batched:
+            future = None
         else:
-            latest_entry = feed.entries[0]
-            link = latest_entry.link
-            logger.info(f"Проверяем ссылку: {link}")
-            if not check_duplicate(link):
-                title, summary = get_article_content(link)
-                if "Ошибка" in title:
-                    error_count += 1
-                    logger.error(f"Ошибка обработки новости: {title}")
+            future = summary_service.submit(candidate["link"], block=False, text=candidate.get("feed_text"))
+            if future is None:
+                release_story(candidate)
+                with candidate_lock:
+                    candidate_queue.appendleft(candidate)
+                continue
+        pending.append((candidate, future))
+
+    for candidate, future in pending:
+        # Ошибка одного кандидата не должна срывать проход и оставлять его историю занятой
+        try:
+            title, summary = batched[candidate["link"]] if future is None else future.result()
+        except Exception as e:
+            count_error(e)
+            error_count += 1
+            release_story(candidate)
+            logger.error(f"Ошибка обработки новости {candidate['link']}: {str(e)}")
+            continue
+        if "Ошибка" in title:
+            error_count += 1
+            release_story(candidate)
+            logger.error(f"Ошибка обработки новости: {title}")
+            continue
+        with ready_lock:
+            ready_queue.append(dict(candidate, title=title, summary=summary, ready_at=time.time(),
+                                    posted=False, delivered=set()))
+        logger.info(f"Пост готов к публикации: {candidate['link']}")
+    scheduler.wake_waiting()
+
+def has_ready_item(channel_id, feeds):
+    with ready_lock:
+        return any(channel_id not in item["delivered"] and (not feeds or item["source"] in feeds)
+                   for item in ready_queue)
+
+def starving_feed_sets():
+    # Наборы источников активных каналов, для которых в очереди нет ни одного поста
+    starving = []
+    for job in scheduler.active_jobs():
+        if not has_ready_item(job["channel_id"], job["feeds"]) and job["feeds"] not in starving:
+            starving.append(job["feeds"])
+    return starving
+
+def take_ready_item(channel_id, feeds):
+    # Первый готовый пост из источников канала, который в этот канал ещё не уходил
+    global duplicate_count
+    prune_ready_queue()
+    with ready_lock:
+        items = list(ready_queue)
+    for item in items:
+        if channel_id in item["delivered"] or (feeds and item["source"] not in feeds):
+            continue
+        if not item["posted"] and (check_duplicate(item["link"]) or check_near_duplicate(item)):
+            duplicate_count += 1
+            discard_ready_items([item])
+            continue
+        return item
+    return None
+
+def ready_queue_status():
+    items = unposted_ready_items()
+    if not items:
+        return 0, None
+    return len(items), time.time() - items[0]["ready_at"]
+
+def pregen_loop():
+    while True:
+        if scheduler.has_active_jobs():
+            try:
+                fill_ready_queue()
+            except Exception as e:
+                count_error(e)
+                logger.error(f"Ошибка предварительной генерации: {str(e)}")
+        # Просыпаемся к ближайшему опросу ленты, но не реже PREGEN_INTERVAL
+        next_poll = feed_registry.next_due()
+        wait_time = PREGEN_INTERVAL if next_poll is None else min(PREGEN_INTERVAL, max(1, next_poll - time.time()))
+        pregen_event.wait(wait_time)
+        pregen_event.clear()
+
+def deliver_to_channel(channel_id, message):
+    if not can_post_to_channel(channel_id):
+        logger.error(f"Нет прав для постинга в {channel_id}")
+        return "no_rights"
+    if send_message(channel_id, message, use_html=True):
+        logger.info(f"Новость успешно запощена в {channel_id}")
+        return "sent"
+    logger.error(f"Не удалось запостить в {channel_id}")
+    return "failed"
+
+def deliver_post(item, channels):
+    # Один пост рассылается во все каналы параллельно, лимиты держит telegram_request
+    global post_count, error_count, last_post_time
+    link = item["link"]
+    message = f"<b>{item['title']}</b> <a href='{link}'>| Источник</a>\n{item['summary']}\n\n<i>Пост сгенерирован ИИ</i>"
+    logger.debug("Сформировано сообщение: %.50s...", message)
+    deliver = in_log_scope(deliver_to_channel, link=link)
+    futures = {channel_id: fanout_executor.submit(deliver, channel_id, message) for channel_id in channels}
+    statuses = {}
+    for channel_id, future in futures.items():
+        try:
+            statuses[channel_id] = future.result()
+        except Exception as e:
+            count_error(e)
+            logger.error(f"Ошибка доставки в {channel_id}: {str(e)}")
+            statuses[channel_id] = "failed"
+
+    story_id = link_id(link)
+    now = datetime.now().isoformat()
+    with db_transaction() as c:
+        c.executemany("INSERT OR REPLACE INTO deliveries (story_id, channel_id, status, timestamp) VALUES (?, ?, ?, ?)",
+                      [(story_id, channel_id, status, now) for channel_id, status in statuses.items()])
+    item["delivered"].update(statuses)
+    sent = sum(1 for status in statuses.values() if status == "sent")
+    error_count += len(statuses) - sent
+    if sent:
+        if not item["posted"]:
+            save_to_feedcache(item["title"], item["summary"], link, item["source"])
+            remember_story(item)
+            item["posted"] = True
+        post_count += sent
+        last_post_time = time.time()
+    logger.info(f"Пост {link} доставлен в {sent} из {len(statuses)} каналов")
+    return statuses
+
+def run_due_jobs(jobs):
+    # Каналы, сработавшие одновременно и получившие один и тот же пост, обслуживаются одной рассылкой
+    groups = {}
+    waiting = []
+    for job in jobs:
+        item = take_ready_item(job["channel_id"], job["feeds"])
+        if item is None:
+            waiting.append(job["channel_id"])
+            continue
+        groups.setdefault(id(item), (item, []))[1].append(job["channel_id"])
+    for item, channels in groups.values():
+        deliver_post(item, channels)
+    if waiting:
+        logger.info(f"Нет готовых постов для {len(waiting)} каналов, повтор через {SCHEDULER_RETRY_DELAY} сек")
+        pregen_event.set()
+        scheduler.retry(waiting, SCHEDULER_RETRY_DELAY)
+    if groups:
+        pregen_event.set()
+
+class PostScheduler:
+    # Задания постинга по каналам в куче по времени следующего срабатывания.
+    # Один поток-диспетчер спит до ближайшего задания; устаревшие записи кучи
+    # (после смены интервала или остановки) пропускаются при извлечении.
+    def __init__(self):
+        self._jobs = {}
+        self._heap = []
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def load(self):
+        rows = db_fetchall("SELECT channel_id, interval, feeds, next_fire, active FROM schedules")
+        with self._cond:
+            self._jobs = {}
+            self._heap = []
+            for channel_id, interval, feeds, next_fire, active in rows:
+                self._jobs[channel_id] = {
+                    "channel_id": channel_id,
+                    "interval": interval,
+                    "feeds": set(feeds.split(",")) if feeds else set(),
+                    "next_fire": next_fire,
+                    "active": bool(active),
+                }
+                if active:
+                    heapq.heappush(self._heap, (next_fire, channel_id))
+            self._cond.notify()
+        logger.info(f"Расписания загружены: {len(rows)}, активных: {sum(1 for row in rows if row[4])}")
+
+    def _save(self, jobs):
+        with db_transaction() as c:
+            c.executemany("INSERT OR REPLACE INTO schedules (channel_id, interval, feeds, next_fire, active) VALUES (?, ?, ?, ?, ?)",
+                          [(job["channel_id"], job["interval"], ",".join(sorted(job["feeds"])), job["next_fire"], int(job["active"]))
+                           for job in jobs])
+
+    def _job(self, channel_id):
+        job = self._jobs.get(channel_id)
+        if job is None:
+            job = self._jobs[channel_id] = {
+                "channel_id": channel_id,
+                "interval": DEFAULT_POSTING_INTERVAL,
+                "feeds": set(),
+                "next_fire": time.time(),
+                "active": False,
+            }
+        return job
+
+    def _update(self, channel_id, **changes):
+        with self._cond:
+            job = self._job(channel_id)
+            job.update(changes)
+            if job["active"]:
+                heapq.heappush(self._heap, (job["next_fire"], channel_id))
+            self._save([job])
+            self._cond.notify()
+            return dict(job)
+
+    def activate(self, channel_id):
+        return self._update(channel_id, active=True, next_fire=time.time())
+
+    def deactivate(self, channel_id):
+        return self._update(channel_id, active=False)
+
+    def fire_now(self, channel_id):
+        return self._update(channel_id, next_fire=time.time())
+
+    def set_interval(self, channel_id, interval):
+        with self._cond:
+            job = self._job(channel_id)
+            last_fire = job["next_fire"] - job["interval"]
+        return self._update(channel_id, interval=interval, next_fire=max(time.time(), last_fire + interval))
+
+    def set_feeds(self, channel_id, feeds):
+        return self._update(channel_id, feeds=set(feeds))
+
+    def retry(self, channel_ids, delay):
+        # Каналам без готового поста — повтор через delay или сразу после wake_waiting
+        with self._cond:
+            jobs = []
+            for channel_id in channel_ids:
+                job = self._jobs.get(channel_id)
+                if job and job["active"]:
+                    job["next_fire"] = time.time() + delay
+                    job["waiting"] = True
+                    heapq.heappush(self._heap, (job["next_fire"], channel_id))
+                    jobs.append(job)
+            self._save(jobs)
+            self._cond.notify()
+
+    def wake_waiting(self):
+        with self._cond:
+            now = time.time()
+            for job in self._jobs.values():
+                if job["active"] and job.pop("waiting", False):
+                    job["next_fire"] = now
+                    heapq.heappush(self._heap, (now, job["channel_id"]))
+            self._cond.notify()
+
+    def active_jobs(self):
+        with self._cond:
+            return [dict(job) for job in self._jobs.values() if job["active"]]
+
+    def get(self, channel_id):
+        with self._cond:
+            job = self._jobs.get(channel_id)
+            return dict(job) if job else None
+
+    def has_active_jobs(self):
+        with self._cond:
+            return any(job["active"] for job in self._jobs.values())
+
+    def channels_for_source(self, source):
+        with self._cond:
+            return {job["channel_id"] for job in self._jobs.values()
+                    if job["active"] and (not job["feeds"] or source in job["feeds"])}
+
+    def _pop_due(self):
+        # Вызывается под self._cond; ждёт, пока не наступит время хотя бы одного задания
+        while True:
+            now = time.time()
+            due = []
+            while self._heap:
+                next_fire, channel_id = self._heap[0]
+                job = self._jobs.get(channel_id)
+                if not job or not job["active"] or job["next_fire"] != next_fire:
+                    heapq.heappop(self._heap)
                     continue
-                message = f"<b>{title}</b> <a href='{link}'>| Источник</a>\n{summary}\n\n<i>Пост сгенерирован ИИ</i>"
-                logger.info(f"Сформировано сообщение: {message[:50]}...")
-                for (channel_id,) in channels:
-                    if can_post_to_channel(channel_id):
-                        if send_message(channel_id, message, use_html=True):
-                            save_to_feedcache(title, summary, link, rss_url.split('/')[2])
-                            post_count += 1
-                            last_post_time = time.time()
-                            logger.info(f"Новость успешно запощена в {channel_id}")
-                        else:
-                            error_count += 1
-                            logger.error(f"Не удалось запостить в {channel_id}")
-                    else:
-                        error_count += 1
-                        logger.error(f"Нет прав для постинга в {channel_id}")
-            else:
-                duplicate_count += 1
-                logger.info(f"Дубль пропущен: {link}, общее число дублей: {duplicate_count}")
-
-        current_index = (current_index + 1) % len(RSS_URLS)
-        logger.info(f"Ожидание следующего поста ({posting_interval} сек)")
-        next_post_event.wait(posting_interval)
-        next_post_event.clear()
-        if not posting_active:
-            break
+                if next_fire > now:
+                    break
+                heapq.heappop(self._heap)
+                job["next_fire"] = now + job["interval"]
+                job.pop("waiting", None)
+                heapq.heappush(self._heap, (job["next_fire"], channel_id))
+                due.append(job)
+            if due:
+                self._save(due)
+                return [dict(job) for job in due]
+            self._cond.wait(self._heap[0][0] - now if self._heap else None)
 
-def start_posting_thread():
-    global posting_thread, posting_active, start_time
-    if posting_thread is None or not posting_thread.is_alive():
-        posting_active = True
-        start_time = time.time()
-        posting_thread = threading.Thread(target=post_news)
-        posting_thread.start()
-        logger.info("Постинг запущен")
-    else:
-        logger.info("Постинг уже активен")
+    def _run(self):
+        while True:
+            with self._cond:
+                jobs = self._pop_due()
+            logger.info(f"Сработали задания постинга: {len(jobs)}")
+            try:
+                run_due_jobs(jobs)
+            except Exception as e:
+                count_error(e)
+                logger.error(f"Ошибка выполнения заданий постинга: {str(e)}")
+
+    def start(self):
+        with self._cond:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True, name="scheduler")
+                self._thread.start()
+
+scheduler = PostScheduler()
+
+def start_posting_workers():
+    global pregen_thread, start_time
+    scheduler.start()
+    if pregen_thread is None or not pregen_thread.is_alive():
+        start_time = start_time or time.time()
+        pregen_thread = threading.Thread(target=pregen_loop, daemon=True, name="pregen")
+        pregen_thread.start()
 
-def stop_posting_thread():
-    global posting_active, posting_thread
-    posting_active = False
-    next_post_event.set()
-    if posting_thread:
-        posting_thread.join()
-        posting_thread = None
-    logger.info("Постинг остановлен")
+def start_posting(channel_id):
+    scheduler.activate(channel_id)
+    start_posting_workers()
+    pregen_event.set()
+    logger.info(f"Постинг запущен для {channel_id}")
+
+def stop_posting(channel_id):
+    scheduler.deactivate(channel_id)
+    logger.info(f"Постинг остановлен для {channel_id}")
+
+def format_interval(seconds):
+    return f"{seconds // 3600}h {((seconds % 3600) // 60)}m" if seconds >= 3600 else f"{seconds // 60}m"
 
 def get_status(username):
     channel_id = get_channel_by_admin(username)
     uptime = timedelta(seconds=int(time.time() - start_time)) if start_time else "Не запущен"
+    job = scheduler.get(channel_id) if channel_id else None
+    active = bool(job and job["active"])
     next_post = "Не активно"
-    if posting_active and last_post_time:
-        time_since_last = time.time() - last_post_time
-        time_to_next = posting_interval - (time_since_last % posting_interval)
+    if active:
+        time_to_next = max(0, job["next_fire"] - time.time())
         next_post = f"{int(time_to_next // 60)} мин {int(time_to_next % 60)} сек"
-    interval_str = f"{posting_interval // 3600}h {((posting_interval % 3600) // 60)}m" if posting_interval >= 3600 else f"{posting_interval // 60}m"
+    interval_str = format_interval(job["interval"] if job else DEFAULT_POSTING_INTERVAL)
+    channel_feeds = ", ".join(sorted(job["feeds"])) if job and job["feeds"] else "все"
     admins = get_admins(channel_id) if channel_id else []
     creator = get_channel_creator(channel_id) if channel_id else "Неизвестен"
-    current_rss = RSS_URLS[current_index] if current_index < len(RSS_URLS) else "Нет"
+    current_rss = current_source() or "Нет"
+    with candidate_lock:
+        candidates_queued = len(candidate_queue)
+    ready_depth, ready_age = ready_queue_status()
+    ready_age_str = f"{int(ready_age // 60)} мин" if ready_age is not None else "—"
     prompt = get_prompt()
     current_model = get_model()
-    feedcache_size = sqlite3.connect(DB_FILE).execute("SELECT COUNT(*) FROM feedcache").fetchone()[0]
+    feedcache_size = db_fetchone("SELECT COUNT(*) FROM feedcache")[0]
     return f"""
 Статус бота:
 Канал: {channel_id}
 Создатель: @{creator}
 Админы: {', '.join([f'@{a}' for a in admins])}
-Состояние постинга: {'Активен' if posting_active else 'Остановлен'}
+Состояние постинга: {'Активен' if active else 'Остановлен'}
 Текущий интервал: {interval_str}
 Время до следующего поста: {next_post}
+Источники канала: {channel_feeds}
 Текущий RSS: {current_rss}
-Всего RSS-источников: {len(RSS_URLS)}
+Всего RSS-лент: {len(feed_registry.all())} (включено: {len(feed_registry.enabled_urls())})
+Кандидатов в очереди: {candidates_queued}
+Готовых постов: {ready_depth} (старейший: {ready_age_str})
+RSS без изменений (304/хэш): {feed_cache_hits}
+RSS загружено заново: {feed_cache_misses}
 Запощенных постов: {post_count}
 Пропущено дублей: {duplicate_count}
 Ошибок: {error_count}
@@ -499,6 +2596,12 @@ def get_help():
 /startposting - Начать постинг
 /stopposting - Остановить постинг
 /setinterval <time> - Установить интервал (34m, 1h, 2h 53m)
+/setfeeds <источники|all> - Выбрать RSS-источники для канала
+/feeds - Список RSS-лент со статистикой опроса
+/addfeed <url> - Добавить RSS-ленту
+/removefeed <url|источник> - Удалить RSS-ленту
+/disablefeed <url|источник> - Выключить опрос ленты
+/enablefeed <url|источник> - Включить опрос ленты
 /nextpost - Сбросить таймер и запостить
 /skiprss - Пропустить следующий RSS
 /changellm <model> - Сменить модель LLM (например, gpt-4o-mini)
@@ -508,269 +2611,531 @@ def get_help():
 /info - Показать статус бота
 /errinf - Показать последние ошибки
 /errnotification <on/off> - Включить/выключить уведомления об ошибках
-/feedcache - Показать кэш новостей
+/feedcache [страница] - Показать кэш новостей
 /feedcacheclear - Очистить кэш
 /addadmin <username> - Добавить админа
 /removeadmin <username> - Удалить админа
 /debug - Показать последний сырой ответ LLM
 /help - Это сообщение
 """
-    logger.info(f"Текст помощи перед отправкой: {help_text}")
+    update_log.debug("Текст помощи перед отправкой: %s", help_text)
     return help_text
 
 @app.route('/ping', methods=['GET'])
 def ping():
-    logger.info("Получен пинг")
+    update_log.debug("Получен пинг")
     return "OK", 200
 
+update_queues = [queue.Queue(maxsize=max(1, UPDATE_QUEUE_SIZE // UPDATE_WORKERS)) for _ in range(UPDATE_WORKERS)]
+seen_update_ids = OrderedDict()
+seen_update_ids_lock = threading.Lock()
+update_latency = register_metric(Histogram("bot_update_handle_seconds", "Время обработки одного апдейта Telegram"))
+update_wait = register_metric(Histogram("bot_update_queue_wait_seconds", "Время ожидания апдейта в очереди"))
+register_metric(Gauge("bot_update_queue_depth", "Апдейтов в очереди на обработку",
+                      lambda: sum(update_queue.qsize() for update_queue in update_queues)))
+
+def enqueue_update(update, block_timeout=0):
+    # Апдейты одного чата попадают в одну очередь и обрабатываются по порядку.
+    # Возвращает False, если очередь переполнена и Telegram должен повторить доставку.
+    # block_timeout > 0 — ждать места в очереди (long-polling), а не отказывать сразу.
+    update_id = update.get('update_id') if isinstance(update, dict) else None
+    if update_id is not None:
+        with seen_update_ids_lock:
+            if update_id in seen_update_ids:
+                update_log.info(f"Повторная доставка апдейта {update_id} пропущена")
+                return True
+    message = update.get('message', {}) if isinstance(update, dict) else {}
+    chat_id = message.get('chat', {}).get('id', 0)
+    try:
+        update_queues[hash(chat_id) % UPDATE_WORKERS].put((time.monotonic(), update), block=block_timeout > 0, timeout=block_timeout or None)
+    except queue.Full:
+        update_log.error(f"Очередь апдейтов переполнена, апдейт {update_id} отклонён")
+        return False
+    if update_id is not None:
+        with seen_update_ids_lock:
+            seen_update_ids[update_id] = True
+            while len(seen_update_ids) > UPDATE_DEDUP_SIZE:
+                seen_update_ids.popitem(last=False)
+    return True
+
+def update_worker(update_queue):
+    while True:
+        enqueued_at, update = update_queue.get()
+        started = time.monotonic()
+        update_wait.observe(started - enqueued_at)
+        message = update.get('message', {}) if isinstance(update, dict) else {}
+        try:
+            with log_scope(update_id=update.get('update_id') if isinstance(update, dict) else None,
+                           chat_id=message.get('chat', {}).get('id')):
+                handle_update(update)
+        except Exception as e:
+            count_error(e)
+            update_log.error(f"Ошибка обработки апдейта: {str(e)}")
+        finally:
+            update_latency.observe(time.monotonic() - started)
+            update_queue.task_done()
+
+def start_update_workers():
+    for worker_queue in update_queues:
+        threading.Thread(target=update_worker, args=(worker_queue,), daemon=True, name="update-worker").start()
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
 @app.route('/webhook', methods=['POST'])
 def webhook():
-    logger.info("Получен запрос на /webhook")
-    update = request.get_json()
-    logger.info(f"Данные запроса: {json.dumps(update, ensure_ascii=False)}")
+    update_log.debug("Получен запрос на /webhook", extra=SAMPLED)
+    update = request.get_json(silent=True)
+    if not enqueue_update(update or {}):
+        return "Busy", 503
+    return "OK", 200
+
+COMMAND_RE = re.compile(r'^(/[A-Za-z_]+)(?:@\w+)?(?:\s+(.*))?$', re.S)
+SQLITE_UPLOAD_PROMPT = "Отправьте файл базы данных (feedcache.db) в ответ на это сообщение"
+NOT_ADMIN_MESSAGE = "Вы не админ ни одного канала."
+
+commands = {}
+
+class CommandUsageError(ValueError):
+    pass
+
+def command(name, admin=True, parser=None):
+    # Регистрирует обработчик команды. admin=True — только для админов канала,
+    # parser превращает текст после команды в аргумент или бросает CommandUsageError
+    def register(handler):
+        commands[name] = {"handler": handler, "admin": admin, "parser": parser}
+        return handler
+    return register
+
+def required_text(usage):
+    def parse(rest):
+        if not rest:
+            raise CommandUsageError(usage)
+        return rest
+    return parse
+
+def required_word(usage):
+    def parse(rest):
+        if not rest:
+            raise CommandUsageError(usage)
+        return rest.split()[0]
+    return parse
+
+def interval_arg(rest):
+    if not rest:
+        raise CommandUsageError("Укажите интервал: /setinterval 34m")
+    seconds = parse_interval(rest)
+    if not seconds:
+        raise CommandUsageError("Неверный формат. Используйте: /setinterval 34m, 1h, 2h 53m")
+    return rest, seconds
+
+def page_arg(rest):
+    if not rest:
+        return 1
+    if not rest.split()[0].isdigit() or int(rest.split()[0]) < 1:
+        raise CommandUsageError("Укажите номер страницы: /feedcache 2")
+    return int(rest.split()[0])
+
+def switch_arg(rest):
+    if not rest:
+        raise CommandUsageError("Укажите состояние: /errnotification on или /errnotification off")
+    state = rest.split()[0].lower()
+    if state not in ['on', 'off']:
+        raise CommandUsageError("Используйте: /errnotification on или /errnotification off")
+    return state
+
+def dispatch_command(ctx):
+    match = COMMAND_RE.match(ctx["text"])
+    if not match:
+        return False
+    spec = commands.get(match.group(1))
+    if spec is None:
+        return False
+    if spec["admin"] and not ctx["channel"]:
+        send_message(ctx["chat_id"], NOT_ADMIN_MESSAGE)
+        return True
+    args = (match.group(2) or "").strip()
+    if spec["parser"]:
+        try:
+            args = spec["parser"](args)
+        except CommandUsageError as e:
+            send_message(ctx["chat_id"], str(e))
+            return True
+    spec["handler"](ctx, args)
+    return True
+
+@command('/start', admin=False)
+def cmd_start(ctx, args):
+    if ctx["channel"]:
+        send_message(ctx["chat_id"], f"Вы уже админ канала {ctx['channel']}. Используйте /startposting для начала.")
+    elif not get_channels():
+        send_message(ctx["chat_id"], "Укажите ID канала для постинга (например, @channelname или -1001234567890):")
+    else:
+        send_message(ctx["chat_id"], "У вас нет прав на управление ботом. Обратитесь к администратору канала.")
+
+@command('/startposting')
+def cmd_startposting(ctx, args):
+    start_posting(ctx["channel"])
+    send_message(ctx["chat_id"], f"Постинг начат в {ctx['channel']}")
+
+@command('/stopposting')
+def cmd_stopposting(ctx, args):
+    stop_posting(ctx["channel"])
+    send_message(ctx["chat_id"], "Постинг остановлен")
+
+@command('/setinterval', parser=interval_arg)
+def cmd_setinterval(ctx, args):
+    interval_str, seconds = args
+    scheduler.set_interval(ctx["channel"], seconds)
+    send_message(ctx["chat_id"], f"Интервал постинга установлен: {interval_str}")
+
+@command('/setfeeds')
+def cmd_setfeeds(ctx, args):
+    words = args.split()
+    sources = feed_registry.sources()
+    if not words:
+        send_message(ctx["chat_id"], "Укажите источники: /setfeeds theverge.com 9to5mac.com или /setfeeds all\nДоступные: " + ", ".join(sources))
+    elif words == ['all']:
+        scheduler.set_feeds(ctx["channel"], [])
+        send_message(ctx["chat_id"], "Канал получает новости из всех источников")
+    else:
+        selected = {source for source in sources for word in words if source == word or source.endswith("." + word)}
+        if selected:
+            scheduler.set_feeds(ctx["channel"], selected)
+            send_message(ctx["chat_id"], "Источники канала: " + ", ".join(sorted(selected)))
+        else:
+            send_message(ctx["chat_id"], "Источники не найдены. Доступные: " + ", ".join(sources))
+
+def feed_arg(usage):
+    def parse(rest):
+        if not rest:
+            raise CommandUsageError(usage)
+        urls = feed_registry.find(rest.split()[0])
+        if not urls:
+            raise CommandUsageError("Лента не найдена. Список лент: /feeds")
+        return urls
+    return parse
+
+def format_feed(feed):
+    state = "вкл" if feed["enabled"] else "выкл"
+    rate = f"{feed['items_per_day']:.1f}/день" if feed["items_per_day"] is not None else "нет данных"
+    last_new = time.strftime('%Y-%m-%d %H:%M', time.gmtime(feed["last_new_item"])) if feed["last_new_item"] else "—"
+    line = f"{feed['url']} [{state}]\n  записей: {rate}, последняя: {last_new}, опрос раз в {int(feed['poll_interval'] or 0) // 60} мин"
+    if feed["error_streak"]:
+        line += f"\n  ошибок подряд: {feed['error_streak']} ({feed['last_error']})"
+    return line
+
+@command('/feeds')
+def cmd_feeds(ctx, args):
+    feeds = sorted(feed_registry.all(), key=lambda feed: feed["url"])
+    if not feeds:
+        send_message(ctx["chat_id"], "Лент нет. Добавьте: /addfeed <url>")
+        return
+    send_message(ctx["chat_id"], "RSS-ленты:\n" + "\n".join(format_feed(feed) for feed in feeds), use_html=False)
+
+@command('/addfeed', parser=required_word("Укажите адрес ленты: /addfeed https://example.com/feed"))
+def cmd_addfeed(ctx, rss_url):
+    if not re.match(r'^https?://[^/\s]+', rss_url):
+        send_message(ctx["chat_id"], "Адрес ленты должен начинаться с http:// или https://")
+        return
+    if feed_registry.find(rss_url) == [rss_url]:
+        send_message(ctx["chat_id"], f"Лента {rss_url} уже добавлена")
+        return
+    try:
+        entries = probe_feed(rss_url)
+    except Exception as e:
+        count_error(e)
+        send_message(ctx["chat_id"], f"Не удалось загрузить ленту: {str(e)}", use_html=False)
+        return
+    if not entries:
+        send_message(ctx["chat_id"], "По этому адресу нет записей RSS/Atom")
+        return
+    feed_registry.add(rss_url)
+    pregen_event.set()
+    send_message(ctx["chat_id"], f"Лента {rss_url} добавлена, записей сейчас: {len(entries)}")
+
+@command('/removefeed', parser=feed_arg("Укажите ленту: /removefeed <url|источник>"))
+def cmd_removefeed(ctx, urls):
+    for rss_url in urls:
+        feed_registry.remove(rss_url)
+    send_message(ctx["chat_id"], "Удалены ленты:\n" + "\n".join(urls))
+
+@command('/disablefeed', parser=feed_arg("Укажите ленту: /disablefeed <url|источник>"))
+def cmd_disablefeed(ctx, urls):
+    for rss_url in urls:
+        feed_registry.set_enabled(rss_url, False)
+    send_message(ctx["chat_id"], "Выключены ленты:\n" + "\n".join(urls))
+
+@command('/enablefeed', parser=feed_arg("Укажите ленту: /enablefeed <url|источник>"))
+def cmd_enablefeed(ctx, urls):
+    for rss_url in urls:
+        feed_registry.set_enabled(rss_url, True)
+    pregen_event.set()
+    send_message(ctx["chat_id"], "Включены ленты:\n" + "\n".join(urls))
+
+@command('/nextpost')
+def cmd_nextpost(ctx, args):
+    job = scheduler.get(ctx["channel"])
+    if job and job["active"]:
+        scheduler.fire_now(ctx["channel"])
+        send_message(ctx["chat_id"], "Таймер сброшен. Следующий пост будет опубликован немедленно.")
+    else:
+        send_message(ctx["chat_id"], "Постинг не активен. Сначала используйте /startposting.")
+
+@command('/skiprss')
+def cmd_skiprss(ctx, args):
+    if not scheduler.has_active_jobs():
+        send_message(ctx["chat_id"], "Постинг не активен. Сначала используйте /startposting.")
+        return
+    skipped = skip_current_source()
+    if skipped:
+        send_message(ctx["chat_id"], f"RSS {skipped} пропущен. Новый текущий: {current_source() or 'Нет'}")
+    else:
+        send_message(ctx["chat_id"], "Очередь кандидатов пуста, пропускать нечего.")
+
+@command('/editprompt', parser=required_text("Отправьте новый промпт после команды, например:\n/editprompt Новый промпт здесь"))
+def cmd_editprompt(ctx, new_prompt):
+    set_prompt(new_prompt)
+    send_message(ctx["chat_id"], "Промпт обновлён:\n" + new_prompt)
+
+@command('/changellm', parser=required_word("Укажите модель, например: /changellm gpt-4o-mini\nДоступные модели: см. https://platform.openai.com/docs/models"))
+def cmd_changellm(ctx, new_model):
+    set_model(new_model)
+    send_message(ctx["chat_id"], f"Модель изменена на: {new_model}")
+
+@command('/sqlitebackup')
+def cmd_sqlitebackup(ctx, args):
+    if not os.path.exists(DB_FILE):
+        send_message(ctx["chat_id"], "База данных не найдена")
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = os.path.join(tmp_dir, os.path.basename(DB_FILE))
+        export_db(snapshot_path)
+        send_file(ctx["chat_id"], snapshot_path)
+    send_message(ctx["chat_id"], "База данных выгружена")
+
+@command('/sqliteupdate')
+def cmd_sqliteupdate(ctx, args):
+    send_message(ctx["chat_id"], SQLITE_UPLOAD_PROMPT)
+
+@command('/info')
+def cmd_info(ctx, args):
+    send_message(ctx["chat_id"], get_status(ctx["username"]))
+
+@command('/errinf')
+def cmd_errinf(ctx, args):
+    error_log.flush()
+    errors = db_fetchall("SELECT timestamp, message, link FROM errors ORDER BY timestamp DESC LIMIT 10")
+    if not errors:
+        send_message(ctx["chat_id"], "Ошибок пока нет.")
+    else:
+        error_list = "\n".join([f"{ts} - {msg} (Ссылка: {link})" for ts, msg, link in errors])
+        send_message(ctx["chat_id"], f"Последние ошибки:\n{error_list}", use_html=False)
+
+@command('/errnotification', parser=switch_arg)
+def cmd_errnotification(ctx, state):
+    set_error_notifications(state)
+    send_message(ctx["chat_id"], f"Уведомления об ошибках: {state}")
+
+@command('/feedcache', parser=page_arg)
+def cmd_feedcache(ctx, page):
+    total = db_fetchone("SELECT COUNT(*) FROM feedcache")[0]
+    if not total:
+        send_message(ctx["chat_id"], "Feedcache пуст")
+        return
+    pages = (total + FEEDCACHE_PAGE_SIZE - 1) // FEEDCACHE_PAGE_SIZE
+    page = min(page, pages)
+    rows = db_fetchall("SELECT timestamp, source, title, link FROM feedcache ORDER BY timestamp DESC LIMIT ? OFFSET ?",
+                       (FEEDCACHE_PAGE_SIZE, (page - 1) * FEEDCACHE_PAGE_SIZE))
+    lines = [f"Feedcache, страница {page} из {pages} (записей: {total}):"]
+    for timestamp, source, title, link in rows:
+        lines.append(f"\n{timestamp[:16].replace('T', ' ')} {source}\n{title}\n{link}")
+    if page < pages:
+        lines.append(f"\nДальше: /feedcache {page + 1}")
+    send_message(ctx["chat_id"], "\n".join(lines)[:4096], use_html=False)
+
+@command('/feedcacheclear')
+def cmd_feedcacheclear(ctx, args):
+    with db_transaction() as c:
+        c.execute("DELETE FROM feedcache")
+        c.execute("DELETE FROM seen_links")
+        c.execute("DELETE FROM story_signatures")
+    dedup_index.clear()
+    near_dup_index.warm()
+    send_message(ctx["chat_id"], "Feedcache очищен")
+
+@command('/addadmin', parser=required_word("Укажите username: /addadmin @username"))
+def cmd_addadmin(ctx, new_admin):
+    new_admin = new_admin.lstrip('@')
+    if add_admin(ctx["channel"], new_admin, ctx["username"]):
+        send_message(ctx["chat_id"], f"@{new_admin} добавлен как админ канала {ctx['channel']}")
+    else:
+        send_message(ctx["chat_id"], "Вы не можете добавлять админов или пользователь уже админ.")
+
+@command('/removeadmin', parser=required_word("Укажите username: /removeadmin @username"))
+def cmd_removeadmin(ctx, admin_to_remove):
+    admin_to_remove = admin_to_remove.lstrip('@')
+    if remove_admin(ctx["channel"], admin_to_remove, ctx["username"]):
+        send_message(ctx["chat_id"], f"@{admin_to_remove} удалён из админов канала {ctx['channel']}")
+    else:
+        send_message(ctx["chat_id"], "Нельзя удалить создателя или вы не админ.")
+
+@command('/debug')
+def cmd_debug(ctx, args):
+    update_log.info(f"Debug: Запрос от @{ctx['username']} для показа последнего ответа LLM")
+    if last_llm_response:
+        response_text = (
+            f"Последний сырой ответ LLM:\n\n"
+            f"Ссылка: {last_llm_response['link']}\n"
+            f"Время: {last_llm_response['timestamp']}\n\n"
+            f"{last_llm_response['response']}"
+        )
+        send_message(ctx["chat_id"], response_text, use_html=False)
+        update_log.info(f"Debug: Последний ответ отправлен в {ctx['chat_id']}: {last_llm_response['response'][:50]}...")
+    else:
+        send_message(ctx["chat_id"], "Нет сохранённых ответов LLM. Попробуйте позже после обработки новости.")
+        update_log.info("Debug: Нет сохранённых ответов LLM")
+
+@command('/help', admin=False)
+def cmd_help(ctx, args):
+    send_message(ctx["chat_id"], get_help(), use_html=False)
+
+def bind_channel(ctx):
+    channel_id = ctx["text"]
+    if get_channels():
+        send_message(ctx["chat_id"], "Канал уже привязан. У вас нет прав на его управление.")
+    elif can_post_to_channel(channel_id):
+        save_channel(channel_id, ctx["username"])
+        send_message(ctx["chat_id"], f"Канал {channel_id} привязан. Вы создатель. Используйте /startposting для начала.")
+    else:
+        send_message(ctx["chat_id"], "Бот не имеет прав администратора в этом канале.")
+
+def receive_db_upload(ctx):
+    if not ctx["channel"]:
+        send_message(ctx["chat_id"], NOT_ADMIN_MESSAGE)
+        return
+    document = ctx["message"].get('document')
+    if not document:
+        send_message(ctx["chat_id"], "Прикрепите файл базы данных")
+        return
+    if document['file_name'] != "feedcache.db":
+        send_message(ctx["chat_id"], "Файл должен называться 'feedcache.db'")
+        return
+    response = telegram_request("getFile", http_method="GET", params={"file_id": document['file_id']})
+    file_path = response.json()['result']['file_path']
+    file_url = f"{TELEGRAM_FILE_URL}{file_path}"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        upload_path = os.path.join(tmp_dir, document['file_name'])
+        with open(upload_path, 'wb') as f:
+            f.write(tg_session.get(file_url, timeout=TELEGRAM_TIMEOUT).content)
+        try:
+            import_db(upload_path)
+        except (sqlite3.Error, ValueError) as e:
+            count_error(e)
+            update_log.error(f"Не удалось загрузить базу: {str(e)}")
+            send_message(ctx["chat_id"], f"Не удалось загрузить базу: {str(e)}. Текущая база не изменена.", use_html=False)
+            return
+    send_message(ctx["chat_id"], "База данных обновлена")
+
+def handle_update(update):
+    if update_log.isEnabledFor(logging.DEBUG):
+        update_log.debug("Данные запроса: %s", json.dumps(update, ensure_ascii=False))
 
     if not update or 'message' not in update or 'message_id' not in update['message']:
-        logger.error("Некорректный запрос")
-        return "OK", 200
+        update_log.error("Некорректный запрос")
+        return
 
-    chat_id = update['message']['chat']['id']
-    message_text = update['message'].get('text', '')
-    username = update['message']['from'].get('username', None)
+    message = update['message']
+    username = message['from'].get('username', None)
+    ctx = {
+        "chat_id": message['chat']['id'],
+        "text": message.get('text', ''),
+        "username": username,
+        "message": message,
+    }
 
-    logger.info(f"Получена команда: '{message_text}' от @{username} в чате {chat_id}")
+    update_log.info(f"Получена команда: '{ctx['text']}' от @{username} в чате {ctx['chat_id']}")
 
     if not username:
-        send_message(chat_id, "У вас нет username. Установите его в настройках Telegram.")
-        return "OK", 200
-
-    user_channel = get_channel_by_admin(username)
-
-    if message_text == '/start':
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT channel_id FROM channels")
-        channels = c.fetchall()
-        conn.close()
-
-        if user_channel:
-            send_message(chat_id, f"Вы уже админ канала {user_channel}. Используйте /startposting для начала.")
-        elif not channels:
-            send_message(chat_id, "Укажите ID канала для постинга (например, @channelname или -1001234567890):")
-        else:
-            send_message(chat_id, "У вас нет прав на управление ботом. Обратитесь к администратору канала.")
-    elif message_text.startswith('@') or message_text.startswith('-100'):
-        channel_id = message_text
-        conn = sqlite3.connect(DB_FILE)
-        c = conn.cursor()
-        c.execute("SELECT channel_id FROM channels")
-        if c.fetchone():
-            send_message(chat_id, "Канал уже привязан. У вас нет прав на его управление.")
-        elif can_post_to_channel(channel_id):
-            save_channel(channel_id, username)
-            send_message(chat_id, f"Канал {channel_id} привязан. Вы создатель. Используйте /startposting для начала.")
-        else:
-            send_message(chat_id, "Бот не имеет прав администратора в этом канале.")
-        conn.close()
-    elif message_text == '/startposting':
-        if user_channel:
-            start_posting_thread()
-            send_message(chat_id, f"Постинг начат в {user_channel}")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/stopposting':
-        if user_channel:
-            stop_posting_thread()
-            send_message(chat_id, "Постинг остановлен")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text.startswith('/setinterval'):
-        if user_channel:
-            try:
-                interval_str = message_text.split()[1]
-                new_interval = parse_interval(interval_str)
-                if new_interval:
-                    global posting_interval
-                    posting_interval = new_interval
-                    send_message(chat_id, f"Интервал постинга установлен: {interval_str}")
-                else:
-                    send_message(chat_id, "Неверный формат. Используйте: /setinterval 34m, 1h, 2h 53m")
-            except IndexError:
-                send_message(chat_id, "Укажите интервал: /setinterval 34m")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/nextpost':
-        if user_channel:
-            if posting_active:
-                next_post_event.set()
-                send_message(chat_id, "Таймер сброшен. Следующий пост будет опубликован немедленно.")
-            else:
-                send_message(chat_id, "Постинг не активен. Сначала используйте /startposting.")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/skiprss':
-        if user_channel:
-            if posting_active:
-                global current_index
-                current_index = (current_index + 1) % len(RSS_URLS)
-                send_message(chat_id, f"Следующий RSS пропущен. Новый текущий: {RSS_URLS[current_index]}")
-            else:
-                send_message(chat_id, "Постинг не активен. Сначала используйте /startposting.")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text.startswith('/editprompt'):
-        if user_channel:
-            if len(message_text.split()) == 1:
-                send_message(chat_id, "Отправьте новый промпт после команды, например:\n/editprompt Новый промпт здесь")
-            else:
-                new_prompt = message_text[len('/editprompt '):].strip()
-                set_prompt(new_prompt)
-                send_message(chat_id, "Промпт обновлён:\n" + new_prompt)
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text.startswith('/changellm'):
-        if user_channel:
-            if len(message_text.split()) == 1:
-                send_message(chat_id, "Укажите модель, например: /changellm gpt-4o-mini\nДоступные модели: см. https://platform.openai.com/docs/models")
-            else:
-                new_model = message_text.split()[1]
-                set_model(new_model)
-                send_message(chat_id, f"Модель изменена на: {new_model}")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/sqlitebackup':
-        if user_channel:
-            if os.path.exists(DB_FILE):
-                send_file(chat_id, DB_FILE)
-                send_message(chat_id, "База данных выгружена")
-            else:
-                send_message(chat_id, "База данных не найдена")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/sqliteupdate':
-        if user_channel:
-            send_message(chat_id, "Отправьте файл базы данных (feedcache.db) в ответ на это сообщение")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif 'reply_to_message' in update['message'] and update['message']['reply_to_message'].get('text', '') == "Отправьте файл базы данных (feedcache.db) в ответ на это сообщение":
-        if user_channel:
-            if 'document' in update['message']:
-                file_id = update['message']['document']['file_id']
-                file_name = update['message']['document']['file_name']
-                if file_name != "feedcache.db":
-                    send_message(chat_id, "Файл должен называться 'feedcache.db'")
-                    return "OK", 200
-                response = requests.get(f"{TELEGRAM_URL}getFile?file_id={file_id}")
-                file_path = response.json()['result']['file_path']
-                file_url = f"https://api.telegram.org/file/bot{TELEGRAM_TOKEN}/{file_path}"
-                with open(DB_FILE, 'wb') as f:
-                    f.write(requests.get(file_url).content)
-                send_message(chat_id, "База данных обновлена")
-            else:
-                send_message(chat_id, "Прикрепите файл базы данных")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/info':
-        if user_channel:
-            send_message(chat_id, get_status(username))
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/errinf':
-        if user_channel:
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT timestamp, message, link FROM errors ORDER BY timestamp DESC LIMIT 10")
-            errors = c.fetchall()
-            conn.close()
-            if not errors:
-                send_message(chat_id, "Ошибок пока нет.")
-            else:
-                error_list = "\n".join([f"{ts} - {msg} (Ссылка: {link})" for ts, msg, link in errors])
-                send_message(chat_id, f"Последние ошибки:\n{error_list}", use_html=False)
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text.startswith('/errnotification'):
-        if user_channel:
-            try:
-                state = message_text.split()[1].lower()
-                if state in ['on', 'off']:
-                    set_error_notifications(state)
-                    send_message(chat_id, f"Уведомления об ошибках: {state}")
-                else:
-                    send_message(chat_id, "Используйте: /errnotification on или /errnotification off")
-            except IndexError:
-                send_message(chat_id, "Укажите состояние: /errnotification on или /errnotification off")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/feedcache':
-        if user_channel:
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("SELECT * FROM feedcache")
-            rows = c.fetchall()
-            conn.close()
-            if not rows:
-                send_message(chat_id, "Feedcache пуст")
-            else:
-                cache = [dict(zip(["id", "title", "summary", "link", "source", "timestamp"], row)) for row in rows]
-                send_message(chat_id, "Содержимое feedcache:\n" + json.dumps(cache, ensure_ascii=False, indent=2)[:4096])
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/feedcacheclear':
-        if user_channel:
-            conn = sqlite3.connect(DB_FILE)
-            c = conn.cursor()
-            c.execute("DELETE FROM feedcache")
-            conn.commit()
-            conn.close()
-            send_message(chat_id, "Feedcache очищен")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text.startswith('/addadmin'):
-        if user_channel:
-            try:
-                new_admin = message_text.split()[1].lstrip('@')
-                if add_admin(user_channel, new_admin, username):
-                    send_message(chat_id, f"@{new_admin} добавлен как админ канала {user_channel}")
-                else:
-                    send_message(chat_id, "Вы не можете добавлять админов или пользователь уже админ.")
-            except IndexError:
-                send_message(chat_id, "Укажите username: /addadmin @username")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text.startswith('/removeadmin'):
-        if user_channel:
-            try:
-                admin_to_remove = message_text.split()[1].lstrip('@')
-                if remove_admin(user_channel, admin_to_remove, username):
-                    send_message(chat_id, f"@{admin_to_remove} удалён из админов канала {user_channel}")
-                else:
-                    send_message(chat_id, "Нельзя удалить создателя или вы не админ.")
-            except IndexError:
-                send_message(chat_id, "Укажите username: /removeadmin @username")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/debug':
-        if user_channel:
-            logger.info(f"Debug: Запрос от @{username} для показа последнего ответа LLM")
-            if last_llm_response:
-                response_text = (
-                    f"Последний сырой ответ LLM:\n\n"
-                    f"Ссылка: {last_llm_response['link']}\n"
-                    f"Время: {last_llm_response['timestamp']}\n\n"
-                    f"{last_llm_response['response']}"
-                )
-                send_message(chat_id, response_text, use_html=False)
-                logger.info(f"Debug: Последний ответ отправлен в {chat_id}: {last_llm_response['response'][:50]}...")
-            else:
-                send_message(chat_id, "Нет сохранённых ответов LLM. Попробуйте позже после обработки новости.")
-                logger.info("Debug: Нет сохранённых ответов LLM")
-        else:
-            send_message(chat_id, "Вы не админ ни одного канала.")
-    elif message_text == '/help':
-        logger.info(f"Команда /help вызвана @{username}")
-        send_message(chat_id, get_help(), use_html=False)
+        send_message(ctx["chat_id"], "У вас нет username. Установите его в настройках Telegram.")
+        return
 
-    return "OK", 200
+    ctx["channel"] = get_channel_by_admin(username)
+
+    if dispatch_command(ctx):
+        return
+    if ctx["text"].startswith('@') or ctx["text"].startswith('-100'):
+        bind_channel(ctx)
+    elif message.get('reply_to_message', {}).get('text', '') == SQLITE_UPLOAD_PROMPT:
+        receive_db_upload(ctx)
+
+def fetch_updates(offset):
+    response = telegram_request(
+        "getUpdates",
+        json={"offset": offset, "limit": POLLING_LIMIT, "timeout": POLLING_TIMEOUT, "allowed_updates": ["message"]},
+        timeout=POLLING_TIMEOUT + TELEGRAM_TIMEOUT,
+    )
+    if response.status_code != 200:
+        raise requests.RequestException(f"getUpdates {response.status_code}: {response.text[:200]}")
+    return response.json().get("result", [])
+
+def run_polling():
+    # Long-polling вместо вебхука: апдейты идут в те же очереди, что и из /webhook.
+    # Offset хранится в config и сдвигается только за принятые в очередь апдейты,
+    # поэтому после перезапуска или переполнения очереди пачка запрашивается заново.
+    response = telegram_request("deleteWebhook", json={"drop_pending_updates": False})
+    if response.status_code != 200:
+        update_log.error(f"Не удалось снять вебхук: {response.text}")
+    offset = int(bot_config.get("update_offset") or 0)
+    update_log.info(f"Запущен long-polling, offset {offset}, limit {POLLING_LIMIT}")
+    while True:
+        try:
+            updates = fetch_updates(offset)
+        except (requests.RequestException, ValueError) as e:
+            count_error(e)
+            update_log.error(f"Ошибка getUpdates: {str(e)}")
+            time.sleep(POLLING_RETRY_DELAY)
+            continue
+        next_offset = offset
+        for update in updates:
+            # Очередь полна — ждём воркеров; не дождались — пачка будет запрошена заново
+            if not enqueue_update(update, block_timeout=POLLING_TIMEOUT):
+                break
+            next_offset = max(next_offset, update['update_id'] + 1)
+        if next_offset != offset:
+            offset = next_offset
+            bot_config.set("update_offset", str(offset))
+
+def start_bot():
+    init_db()
+    # Полный VACUUM только здесь, пока базу не использует ни один другой поток
+    db_maintenance.convert()
+    bot_config.load()
+    dedup_index.warm()
+    near_dup_index.warm()
+    if TELEGRAM_TOKEN:
+        try:
+            get_bot_user_id()
+        except Exception as e:
+            count_error(e)
+            logger.error(f"Не удалось получить ID бота при старте: {str(e)}")
+    load_admin_channels()
+    feed_registry.load()
+    feed_registry.poll_all_now()
+    error_log.start()
+    db_maintenance.start()
+    start_update_workers()
+    # Возобновляем постинг каналов, активных до перезапуска
+    scheduler.load()
+    if scheduler.has_active_jobs():
+        start_posting_workers()
+
+if BOT_AUTOSTART:
+    start_bot()
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    if "--polling" in sys.argv[1:] or UPDATE_MODE == "polling":
+        run_polling()
+    else:
+        app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
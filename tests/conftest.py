@@ -0,0 +1,41 @@
+import pytest
+
+from tests.harness import load_bot, reset_db
+from tests.mock_openai import MockOpenAI
+from tests.mock_telegram import MockBotAPI
+
+
+@pytest.fixture
+def bot():
+    module = load_bot()
+    reset_db(module)
+    return module
+
+
+@pytest.fixture
+def sent(bot, monkeypatch):
+    # Ответы бота вместо отправки в Telegram: список (chat_id, text)
+    messages = []
+    monkeypatch.setattr(bot, "send_message", lambda chat_id, text, **kwargs: messages.append((chat_id, text)) or True)
+    return messages
+
+
+@pytest.fixture
+def telegram(bot, monkeypatch):
+    # Бот ходит в локальный MockBotAPI; бакеты пересоздаются под каждый тест
+    with MockBotAPI() as mock:
+        monkeypatch.setattr(bot, "TELEGRAM_TOKEN", mock.token)
+        monkeypatch.setattr(bot, "TELEGRAM_URL", mock.bot_url)
+        monkeypatch.setattr(bot, "TELEGRAM_FILE_URL", f"{mock.base_url}/file/bot{mock.token}/")
+        monkeypatch.setattr(bot, "tg_chat_buckets", {})
+        monkeypatch.setattr(bot, "tg_global_bucket", bot.TokenBucket(bot.TELEGRAM_GLOBAL_RATE, bot.TELEGRAM_GLOBAL_RATE))
+        yield mock
+
+
+@pytest.fixture
+def openai(bot, monkeypatch):
+    # Клиент OpenAI смотрит в локальный MockOpenAI, кэш ответов ИИ пуст (reset_db)
+    with MockOpenAI() as mock:
+        monkeypatch.setattr(bot, "OPENAI_API_KEY", "test")
+        monkeypatch.setattr(bot, "openai_client", bot.OpenAI(api_key="test", base_url=mock.base_url, max_retries=0))
+        yield mock
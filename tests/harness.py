@@ -0,0 +1,41 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_bot(**env):
+    # Импорт bot без старта: база во временном каталоге, без getMe и фоновых потоков.
+    # Переменные окружения читаются при импорте, поэтому задаются до него.
+    if "bot" in sys.modules:
+        return sys.modules["bot"]
+    os.environ["BOT_AUTOSTART"] = "off"
+    os.environ.setdefault("DB_FILE", os.path.join(tempfile.mkdtemp(prefix="autonews-"), "feedcache.db"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    os.environ.setdefault("OPENAI_API_KEY", "test")
+    os.environ.update(env)
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    import bot
+    reset_db(bot)
+    return bot
+
+
+def reset_db(bot):
+    # Новая база с настройками и лентами по умолчанию и сброс состояния в памяти.
+    # Таблицы пересоздаются: ленты по умолчанию пишутся только в новую таблицу feeds
+    tables = [name for name, in bot.db_fetchall("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'")]
+    with bot.db_transaction() as c:
+        for table in tables:
+            c.execute(f"DROP TABLE {table}")
+    bot.init_db()
+    bot.bot_config.load()
+    bot.dedup_index.warm()
+    bot.near_dup_index.warm()
+    bot.load_admin_channels()
+    bot.feed_registry.load()
+    bot.scheduler.load()
+    bot.candidate_queue.clear()
+    bot.fetched_feeds.clear()
+    bot.ready_queue.clear()
@@ -0,0 +1,111 @@
+import json
+import re
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BATCH_URL_RE = re.compile(r"^\d+\. (\S+)$", re.M)
+
+
+class MockOpenAI:
+    # Локальный OpenAI-совместимый /v1/chat/completions. По умолчанию отвечает
+    # "Заголовок\nПересказ." на одиночный запрос и валидным JSON на пакетный;
+    # responder(body, prompt) может вернуть свой текст ответа. prompt_tokens ~ символы / 4.
+    def __init__(self, latency=0.0, responder=None):
+        self.latency = latency
+        self.responder = responder
+        self.requests = []
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def fail(self, times=1, status=429, retry_after=None, retry_after_ms=None):
+        with self._lock:
+            self._failures.extend([(status, retry_after, retry_after_ms)] * times)
+
+    def batch_requests(self):
+        with self._lock:
+            return [body for body in self.requests if body.get("response_format")]
+
+    def single_requests(self):
+        with self._lock:
+            return [body for body in self.requests if not body.get("response_format")]
+
+    def default_content(self, body, prompt):
+        if body.get("response_format"):
+            urls = BATCH_URL_RE.findall(prompt)
+            return json.dumps({"items": [{"url": url, "title": f"Заголовок {n}", "summary": "Пересказ статьи."}
+                                         for n, url in enumerate(urls)]}, ensure_ascii=False)
+        return "Заголовок новости\nКраткий пересказ статьи."
+
+    def _complete(self, body):
+        prompt = body["messages"][0]["content"]
+        content = (self.responder or self.default_content)(body, prompt)
+        prompt_tokens = len(prompt) // 4
+        completion_tokens = len(content) // 4
+        return {
+            "id": "chatcmpl-mock", "object": "chat.completion", "created": int(time.time()), "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def reply(self, status, body, headers=()):
+                data = json.dumps(body, ensure_ascii=False).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with mock._lock:
+                    mock.requests.append(body)
+                    failure = mock._failures.pop(0) if mock._failures else None
+                if failure:
+                    status, retry_after, retry_after_ms = failure
+                    headers = [("Retry-After", str(retry_after))] if retry_after is not None else []
+                    if retry_after_ms is not None:
+                        headers.append(("retry-after-ms", str(retry_after_ms)))
+                    return self.reply(status, {"error": {"message": "mock failure", "type": "mock"}}, headers)
+                if mock.latency:
+                    time.sleep(mock.latency)
+                self.reply(200, mock._complete(body))
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="mock-openai").start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
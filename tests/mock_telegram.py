@@ -0,0 +1,133 @@
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+
+class MockBotAPI:
+    # Локальный Bot API: отвечает ok на любые методы, записывает вызовы и умеет
+    # отдавать 429 с retry_after. Адрес подставляется в TELEGRAM_API_BASE / TELEGRAM_URL.
+    # files: file_id -> содержимое, отдаётся через getFile и /file/bot<token>/<file_id>.
+    def __init__(self, token="TEST", latency=0.0):
+        self.token = token
+        self.latency = latency
+        self.calls = []
+        self.updates = []
+        self.member_status = "administrator"
+        self.files = {}
+        self._failures = {}
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    @property
+    def bot_url(self):
+        return f"{self.base_url}/bot{self.token}/"
+
+    def fail(self, method, times=1, retry_after=1):
+        # Следующие times вызовов method получат 429 Too Many Requests
+        with self._lock:
+            self._failures[method] = [times, retry_after]
+
+    def sent(self, method="sendMessage"):
+        with self._lock:
+            return [call for call in self.calls if call["method"] == method]
+
+    def _next_failure(self, method):
+        with self._lock:
+            failure = self._failures.get(method)
+            if not failure or failure[0] <= 0:
+                return None
+            failure[0] -= 1
+            return failure[1]
+
+    def _record(self, method, payload):
+        with self._lock:
+            self.calls.append({"time": time.monotonic(), "method": method, "payload": payload})
+
+    def _result(self, method, payload):
+        if method == "getMe":
+            return {"id": 42, "is_bot": True, "username": "AutoNewsBot"}
+        if method == "getChatMember":
+            return {"status": self.member_status}
+        if method == "getUpdates":
+            offset = payload.get("offset", 0)
+            return [update for update in self.updates if update["update_id"] >= offset][:payload.get("limit", 100)]
+        if method == "getFile":
+            file_id = payload.get("file_id")
+            return {"file_id": file_id, "file_path": file_id, "file_size": len(self.files.get(file_id, b""))}
+        if method == "sendMessage":
+            return {"message_id": len(self.calls), "chat": {"id": payload.get("chat_id")}, "text": payload.get("text")}
+        return True
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                # Без TCP_NODELAY Nagle и delayed ACK добавляют ~40 мс к каждому запросу
+                self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+            def reply(self, status, body, content_type="application/json"):
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def handle_call(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                path, _, query = self.path.partition("?")
+                method = path.rsplit("/", 1)[-1]
+                if path.startswith(f"/file/bot{mock.token}/"):
+                    content = mock.files.get(method)
+                    if content is None:
+                        return self.reply(404, {"ok": False, "error_code": 404, "description": "Not Found"})
+                    return self.reply(200, content, "application/octet-stream")
+                try:
+                    payload = json.loads(body) if body and self.headers.get("Content-Type", "").startswith("application/json") else {}
+                except ValueError:
+                    payload = {}
+                if query and not payload:
+                    payload = dict(parse_qsl(query))
+                mock._record(method, payload)
+                if mock.latency:
+                    time.sleep(mock.latency)
+                retry_after = mock._next_failure(method)
+                if retry_after is not None:
+                    return self.reply(429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                            "parameters": {"retry_after": retry_after}})
+                self.reply(200, {"ok": True, "result": mock._result(method, payload)})
+
+            do_GET = handle_call
+            do_POST = handle_call
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True, name="mock-bot-api").start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,78 @@
+def make_ctx(bot, text, username="alice", chat_id=5):
+    return {
+        "chat_id": chat_id,
+        "text": text,
+        "username": username,
+        "message": {"text": text},
+        "channel": bot.get_channel_by_admin(username),
+    }
+
+
+def bind(bot, channel_id="-1001", username="alice"):
+    bot.save_channel(channel_id, username)
+
+
+def test_unknown_command_is_not_handled(bot, sent):
+    assert not bot.dispatch_command(make_ctx(bot, "/nosuchcommand"))
+    assert not bot.dispatch_command(make_ctx(bot, "hello"))
+    assert sent == []
+
+
+def test_public_command_needs_no_channel(bot, sent):
+    assert bot.dispatch_command(make_ctx(bot, "/start"))
+    assert "Укажите ID канала" in sent[-1][1]
+
+
+def test_admin_command_rejected_without_channel(bot, sent):
+    bind(bot, username="bob")
+    assert bot.dispatch_command(make_ctx(bot, "/setinterval 1h"))
+    assert sent == [(5, bot.NOT_ADMIN_MESSAGE)]
+
+
+def test_command_addressed_to_bot_name(bot, sent):
+    bind(bot)
+    assert bot.dispatch_command(make_ctx(bot, "/setinterval@AutoNewsBot 2h 5m"))
+    assert bot.scheduler.get("-1001")["interval"] == 2 * 3600 + 5 * 60
+    assert sent[-1][1] == "Интервал постинга установлен: 2h 5m"
+
+
+def test_usage_error_is_reported(bot, sent):
+    bind(bot)
+    assert bot.dispatch_command(make_ctx(bot, "/setinterval"))
+    assert sent[-1][1] == "Укажите интервал: /setinterval 34m"
+    assert bot.dispatch_command(make_ctx(bot, "/setinterval soon"))
+    assert sent[-1][1].startswith("Неверный формат")
+    assert bot.scheduler.get("-1001") is None
+
+
+def test_parser_value_reaches_handler(bot, sent):
+    bind(bot)
+    bot.dispatch_command(make_ctx(bot, "/errnotification ON"))
+    assert bot.get_error_notifications()
+    assert sent[-1][1] == "Уведомления об ошибках: on"
+
+
+def test_admin_map_follows_admin_changes(bot, sent):
+    bind(bot)
+    bot.dispatch_command(make_ctx(bot, "/addadmin @carol"))
+    assert bot.get_channel_by_admin("carol") == "-1001"
+    bot.dispatch_command(make_ctx(bot, "/removeadmin carol"))
+    assert bot.get_channel_by_admin("carol") is None
+
+
+def test_handle_update_routes_through_table(bot, sent):
+    bind(bot)
+    bot.handle_update({"message": {"message_id": 1, "from": {"username": "alice"}, "chat": {"id": 7}, "text": "/help"}})
+    assert sent[-1][0] == 7 and "/setinterval" in sent[-1][1]
+
+
+def test_removed_default_feed_stays_removed(bot, sent):
+    bind(bot)
+    removed = bot.DEFAULT_RSS_URLS[0]
+    bot.dispatch_command(make_ctx(bot, f"/removefeed {removed}"))
+    # Перезапуск и /sqliteupdate снова вызывают init_db
+    bot.init_db()
+    bot.feed_registry.load()
+    urls = [feed["url"] for feed in bot.feed_registry.all()]
+    assert removed not in urls
+    assert bot.DEFAULT_RSS_URLS[1] in urls
@@ -0,0 +1,32 @@
+def set_auto_vacuum(bot, mode):
+    conn = bot.get_db()
+    conn.execute(f"PRAGMA auto_vacuum={mode}")
+    conn.execute("VACUUM")
+
+
+def auto_vacuum(bot):
+    return bot.db_fetchone("PRAGMA auto_vacuum")[0]
+
+
+def test_background_run_does_not_convert(bot):
+    # База без auto_vacuum, как у установок до его появления
+    set_auto_vacuum(bot, "NONE")
+    bot.db_maintenance.run()
+    assert auto_vacuum(bot) == 0
+
+
+def test_convert_switches_to_incremental_once(bot):
+    set_auto_vacuum(bot, "NONE")
+    assert bot.db_maintenance.convert()
+    assert auto_vacuum(bot) == 2
+    assert not bot.db_maintenance.convert()
+
+
+def test_incremental_vacuum_frees_pages(bot):
+    with bot.db_transaction() as c:
+        c.executemany("INSERT INTO seen_links (key) VALUES (?)", ((n,) for n in range(20000)))
+    with bot.db_transaction() as c:
+        c.execute("DELETE FROM seen_links")
+    assert bot.db_fetchone("PRAGMA freelist_count")[0] > 0
+    bot.db_maintenance.vacuum()
+    assert bot.db_fetchone("PRAGMA freelist_count")[0] == 0
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "html")
+
+
+def read_page(name):
+    with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def test_article_keeps_only_story_blocks(bot):
+    text = bot.extract_article_text(read_page("news_article.html"))
+    lines = text.split("\n")
+    assert lines[0] == "City council approves new transit plan"
+    assert "What changes for commuters" in lines
+    assert sum(line.startswith(("The ", "Construction", "Opponents")) for line in lines) == 4
+    # Меню, cookie-баннер, кнопки, подпись, врезка, похожие, комментарии, подписка, подвал
+    for noise in ("Technology and science", "cookies", "Share on", "map of the proposed", "biggest investment",
+                  "Related stories", "Bus drivers", "Comments from readers", "Finally!", "newsletter", "Copyright"):
+        assert noise not in text
+
+
+def test_page_without_main_drops_boilerplate_blocks(bot):
+    text = bot.extract_article_text(read_page("no_main.html"))
+    assert text.startswith("Новая версия базы данных вышла в открытый доступ\nРазработчики")
+    assert "Обновиться можно без остановки кластера" in text
+    for noise in ("Главная страница", "Самые читаемые", "Реклама", "Все права защищены"):
+        assert noise not in text
+
+
+def test_main_page_keeps_headings_code_and_tables(bot):
+    text = bot.extract_article_text(read_page("docs_page.html"))
+    assert "Database settings" in text.split("\n")
+    assert "DB_FILE=/var/lib/service/data.db DB_MAINTENANCE_HOURS=6" in text
+    assert "Timeout for downloading one feed" in text
+    assert "Installation on all platforms" not in text
+    assert "Edit this page" not in text
+
+
+def test_class_filter_falls_back_when_it_removes_everything(bot):
+    page = read_page("share_wrapper.html")
+    strict = bot.ArticleExtractor(strict=True, has_main=False)
+    strict.feed(page)
+    assert strict.text() == ""
+    text = bot.extract_article_text(page)
+    assert text.startswith("Why we moved our build system to a single repository")
+    assert text.count("\n") == 4
+
+
+def test_long_article_is_cut_at_paragraph(bot):
+    text = bot.extract_article_text(read_page("long_read.html"), max_chars=1000)
+    assert len(text) <= 1000
+    assert text.endswith("of that story.")
+    assert text.split("\n")[-1].startswith("Paragraph ")
+
+
+def test_truncate_text_boundaries(bot):
+    assert bot.truncate_text("short", 10) == "short"
+    assert bot.truncate_text("x" * 10, 10) == "x" * 10
+    # Граница предложения во второй половине бюджета
+    assert bot.truncate_text("First sentence here. Second one is longer", 30) == "First sentence here."
+    # Граница слишком близко к началу — режем по бюджету с многоточием
+    assert bot.truncate_text("Hi. " + "y" * 40, 20) == "Hi. " + "y" * 16 + "…"
+    assert bot.truncate_text("one\ntwo three four five six", 10) == "one\ntwo th…"
+
+
+@pytest.fixture
+def stalled_page():
+    # Заголовки и начало страницы приходят сразу, остальное — никогда
+    release = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", "100000")
+            self.end_headers()
+            self.wfile.write(b"<html><body><article><p>")
+            self.wfile.flush()
+            release.wait(10)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/article"
+    release.set()
+    server.shutdown()
+    server.server_close()
+
+
+def test_stalled_page_gives_empty_text(bot, stalled_page, monkeypatch):
+    monkeypatch.setattr(bot, "ARTICLE_FETCH_TIMEOUT", 0.5)
+    started = time.monotonic()
+    assert bot.fetch_article_text(stalled_page) == ""
+    assert time.monotonic() - started < 5
+
+
+def test_stalled_page_still_summarized(bot, openai, stalled_page, monkeypatch):
+    monkeypatch.setattr(bot, "ARTICLE_FETCH_TIMEOUT", 0.5)
+    assert bot.summarize_article(stalled_page) == ("Заголовок новости", "Краткий пересказ статьи.")
+    assert "Текст статьи недоступен." in openai.requests[0]["messages"][0]["content"]
@@ -0,0 +1,178 @@
+import hashlib
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import feedparser
+import pytest
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "feeds")
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES, name), "rb") as f:
+        return f.read()
+
+
+def chunked(data, size):
+    return (data[start:start + size] for start in range(0, len(data), size))
+
+
+def entry_fields(bot, entry):
+    # Поля, которые использует make_candidate
+    published = entry.get("published_parsed") or entry.get("updated_parsed")
+    content = entry.get("content") or []
+    return {
+        "link": entry.get("feedburner_origlink") or entry.link,
+        "id": entry.get("id"),
+        "title": bot.strip_html(entry.get("title", "")).strip(),
+        "summary": " ".join(bot.strip_html(entry.get("summary", "")).split()),
+        "published": tuple(published)[:6] if published else None,
+        "content": bot.extract_article_text(content[0].get("value", "")) if content else "",
+    }
+
+
+@pytest.mark.parametrize("name", ["rss2.xml", "rss1.xml", "atom.xml"])
+@pytest.mark.parametrize("chunk_size", [64 * 1024, 97])
+def test_stream_matches_feedparser(bot, name, chunk_size):
+    data = read_fixture(name)
+    expected = [entry_fields(bot, entry) for entry in feedparser.parse(data).entries]
+    actual = [entry_fields(bot, entry) for entry in bot.stream_feed_entries(chunked(data, chunk_size))]
+    assert len(expected) >= 3
+    assert actual == expected
+
+
+def test_stream_stops_at_first_seen_link(bot):
+    data = read_fixture("rss2.xml")
+    seen = "https://tech.example.com/2026/10/16/database-3/"
+    entries = list(bot.stream_feed_entries(chunked(data, 256), lambda link: link == seen))
+    assert [entry.get("feedburner_origlink") or entry.link for entry in entries] == [
+        "https://tech.example.com/2026/10/17/startup-raises/",
+        "https://tech.example.com/2026/10/17/patent-dispute/",
+    ]
+
+
+def test_rss1_items_get_rdf_about_as_id(bot):
+    entries = list(bot.stream_feed_entries([read_fixture("rss1.xml")]))
+    assert [entry.id for entry in entries] == [f"https://news.example.org/story/{n}" for n in (3, 2, 1)]
+
+
+@pytest.fixture
+def feed_server():
+    # Лента с ETag: на совпавший If-None-Match отвечает 304. trickle > 0 — тело
+    # отдаётся десятью кусками за trickle секунд
+    server_state = SimpleNamespace(data=read_fixture("rss2.xml"), requests=[], trickle=0)
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            server_state.requests.append(dict(self.headers))
+            if self.headers.get("If-None-Match") == '"v1"':
+                self.send_response(304)
+                self.end_headers()
+                return
+            data = server_state.data
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            if not server_state.trickle:
+                self.wfile.write(data)
+                return
+            step = len(data) // 10 + 1
+            for start in range(0, len(data), step):
+                time.sleep(server_state.trickle / 10)
+                self.wfile.write(data[start:start + step])
+                self.wfile.flush()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    server_state.url = f"http://127.0.0.1:{server.server_address[1]}/feed"
+    yield server_state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_first_fetch_after_restart_ignores_validators(bot, feed_server, monkeypatch, streaming):
+    monkeypatch.setattr(bot, "FEED_STREAMING", streaming)
+    monkeypatch.setattr(bot.feed_registry, "due", lambda: [feed_server.url])
+    # Валидаторы остались от прошлого запуска, очередь кандидатов пуста
+    bot.save_feed_validators(feed_server.url, '"v1"', None, hashlib.md5(feed_server.data).hexdigest())
+    assert len(bot.fetch_all_feeds()[feed_server.url]) >= 3
+    assert "If-None-Match" not in feed_server.requests[0]
+    assert bot.fetch_all_feeds() == {feed_server.url: None}
+    assert feed_server.requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_late_fetch_does_not_save_validators(bot, feed_server, monkeypatch):
+    # Загрузка закончилась после общего таймаута: записи выброшены, поэтому
+    # следующий опрос должен скачать ленту заново, а не получить 304
+    monkeypatch.setattr(bot, "FEED_TIMEOUT", 0.3)
+    monkeypatch.setattr(bot.feed_registry, "due", lambda: [feed_server.url])
+    feed_server.trickle = 1.5
+    assert bot.fetch_all_feeds() == {}
+    time.sleep(2)
+    assert bot.get_feed_validators(feed_server.url) == (None, None, None)
+    assert feed_server.url not in bot.fetched_feeds
+    feed_server.trickle = 0
+    assert len(bot.fetch_all_feeds()[feed_server.url]) >= 3
+    assert "If-None-Match" not in feed_server.requests[1]
+    assert bot.get_feed_validators(feed_server.url)[0] == '"v1"'
+
+
+def test_all_feeds_due_after_start(bot):
+    url = bot.DEFAULT_RSS_URLS[0]
+    bot.feed_registry.record_success(url, [time.time()])
+    assert url not in bot.feed_registry.due()
+    bot.feed_registry.poll_all_now()
+    assert set(bot.feed_registry.due()) == set(bot.feed_registry.enabled_urls())
+
+
+@pytest.fixture
+def endless_feed():
+    # Лента, которая шлёт по записи каждые 50 мс и не заканчивается
+    stop = threading.Event()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/rss+xml")
+            self.end_headers()
+            self.wfile.write(b'<?xml version="1.0"?><rss version="2.0"><channel><title>Endless</title>')
+            number = 0
+            while not stop.is_set():
+                number += 1
+                try:
+                    self.wfile.write(b"<item><title>Item %d</title><link>https://endless.example/%d</link></item>" % (number, number))
+                    self.wfile.flush()
+                except OSError:
+                    return
+                time.sleep(0.05)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/feed"
+    stop.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_feed_fetch_has_total_deadline(bot, endless_feed, monkeypatch, streaming):
+    monkeypatch.setattr(bot, "FEED_STREAMING", streaming)
+    monkeypatch.setattr(bot, "FEED_TIMEOUT", 1)
+    started = time.monotonic()
+    with pytest.raises(bot.requests.Timeout):
+        bot.fetch_feed(endless_feed)
+    assert time.monotonic() - started < 2
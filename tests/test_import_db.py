@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+
+def export_db(bot, path, page_size=None):
+    # Копия живой базы как файл, который админ присылает в /sqliteupdate
+    dst = sqlite3.connect(path)
+    bot.get_db().backup(dst)
+    if page_size:
+        dst.execute("PRAGMA journal_mode=DELETE")
+        dst.execute(f"PRAGMA page_size={page_size}")
+        dst.execute("VACUUM")
+    dst.close()
+
+
+def test_import_converts_page_size(bot, tmp_path):
+    bot.bot_config.set("prompt", "из загрузки")
+    upload = tmp_path / "feedcache.db"
+    export_db(bot, upload, page_size=1024)
+    bot.bot_config.set("prompt", "живая")
+    bot.import_db(str(upload))
+    assert bot.bot_config.prompt == "из загрузки"
+    assert bot.db_fetchone("PRAGMA page_size")[0] != 1024
+
+
+def test_junk_file_is_rejected_and_live_db_kept(bot, tmp_path):
+    bot.bot_config.set("prompt", "живая")
+    upload = tmp_path / "feedcache.db"
+    upload.write_bytes(b"not a database" * 100)
+    with pytest.raises(sqlite3.DatabaseError):
+        bot.import_db(str(upload))
+    assert bot.bot_config.prompt == "живая"
+    assert bot.db_fetchone("SELECT value FROM config WHERE key = 'prompt'")[0] == "живая"
+
+
+def test_foreign_sqlite_file_is_rejected(bot, tmp_path):
+    upload = tmp_path / "feedcache.db"
+    other = sqlite3.connect(upload)
+    other.execute("CREATE TABLE notes (text TEXT)")
+    other.commit()
+    other.close()
+    with pytest.raises(ValueError):
+        bot.import_db(str(upload))
+    assert bot.db_fetchone("SELECT name FROM sqlite_master WHERE name = 'notes'") is None
+
+
+def upload_ctx(bot, file_id):
+    return {
+        "chat_id": 5, "text": "", "username": "alice", "channel": "-1001",
+        "message": {"document": {"file_id": file_id, "file_name": "feedcache.db"}},
+    }
+
+
+def test_upload_error_is_reported_to_admin(bot, telegram):
+    telegram.files["junk"] = b"not a database" * 100
+    bot.receive_db_upload(upload_ctx(bot, "junk"))
+    reply = telegram.sent()[-1]["payload"]["text"]
+    assert reply.startswith("Не удалось загрузить базу")
+
+
+def test_upload_replaces_database(bot, telegram, tmp_path):
+    bot.bot_config.set("prompt", "из загрузки")
+    upload = tmp_path / "upload.db"
+    export_db(bot, upload, page_size=1024)
+    bot.bot_config.set("prompt", "живая")
+    telegram.files["good"] = upload.read_bytes()
+    bot.receive_db_upload(upload_ctx(bot, "good"))
+    assert telegram.sent()[-1]["payload"]["text"] == "База данных обновлена"
+    assert bot.bot_config.prompt == "из загрузки"
@@ -0,0 +1,77 @@
+import json
+
+URLS = [
+    "https://www.example.com/news/one/",
+    "https://example.com/news/two?utm_source=rss",
+    "https://example.com/news/three",
+]
+TEXTS = {url: f"Текст статьи {n}. " * 20 for n, url in enumerate(URLS)}
+# Заметно разные истории, чтобы индекс похожих новостей не отсеял кандидатов
+STORIES = ["выборы мэра прошли во вторник", "сборная выиграла финал чемпионата", "цены на нефть упали третий день"]
+
+
+def respond_with(items):
+    def responder(body, prompt):
+        if body.get("response_format"):
+            return json.dumps({"items": items}, ensure_ascii=False)
+        return "Одиночный заголовок\nОдиночный пересказ."
+    return responder
+
+
+def test_batch_maps_items_by_canonical_url(bot, openai):
+    # Модель вернула ссылки в другом виде и в другом порядке
+    openai.responder = respond_with([
+        {"url": "https://example.com/news/three#comments", "title": "Третий", "summary": "Пересказ три."},
+        {"url": "http://example.com/news/one", "title": "Первый", "summary": "Пересказ один."},
+        {"url": "https://m.example.com/news/two/?utm_medium=feed", "title": "Второй", "summary": "Пересказ два."},
+    ])
+    results = bot.summarize_batch(URLS, TEXTS)
+    assert results == {
+        URLS[0]: ("Первый", "Пересказ один."),
+        URLS[1]: ("Второй", "Пересказ два."),
+        URLS[2]: ("Третий", "Пересказ три."),
+    }
+    assert len(openai.requests) == 1
+    # Приняты в кэш под ключом одиночного запроса
+    assert bot.summarize_article(URLS[1]) == ("Второй", "Пересказ два.")
+    assert len(openai.requests) == 1
+
+
+def test_invalid_items_are_left_out(bot, openai):
+    openai.responder = respond_with([
+        {"url": URLS[0], "title": "Первый", "summary": "Пересказ один."},
+        {"url": URLS[1], "title": "🔥🔥🔥", "summary": "Пересказ два."},
+        {"url": "https://example.com/unknown", "title": "Лишний", "summary": "Не из пакета."},
+        "not an object",
+        {"url": URLS[2], "title": "Третий", "summary": ""},
+    ])
+    assert bot.summarize_batch(URLS, TEXTS) == {URLS[0]: ("Первый", "Пересказ один.")}
+
+
+def test_malformed_batch_returns_nothing(bot, openai):
+    openai.responder = lambda body, prompt: "not json at all"
+    assert bot.summarize_batch(URLS, TEXTS) == {}
+
+
+def test_fill_ready_queue_falls_back_to_single_calls(bot, openai, monkeypatch):
+    monkeypatch.setattr(bot, "LLM_BATCH_SIZE", 3)
+    monkeypatch.setattr(bot, "READY_QUEUE_DEPTH", 3)
+    monkeypatch.setattr(bot, "refresh_candidates", lambda: None)
+    openai.responder = respond_with([
+        {"url": URLS[0], "title": "Первый", "summary": "Пересказ один."},
+        {"url": URLS[2], "title": "Третий", "summary": "Пересказ три."},
+    ])
+    for n, url in enumerate(URLS):
+        bot.candidate_queue.append({"link": url, "guid": url, "source": "example.com", "feed_title": f"Статья {n}",
+                                    "feed_summary": "", "published": 1000 - n, "text": STORIES[n],
+                                    "feed_text": TEXTS[url]})
+    bot.fill_ready_queue()
+    ready = {item["link"]: (item["title"], item["summary"]) for item in bot.ready_queue}
+    assert ready == {
+        URLS[0]: ("Первый", "Пересказ один."),
+        URLS[1]: ("Одиночный заголовок", "Одиночный пересказ."),
+        URLS[2]: ("Третий", "Пересказ три."),
+    }
+    assert len(openai.batch_requests()) == 1
+    assert len(openai.single_requests()) == 1
+    assert URLS[1] in openai.single_requests()[0]["messages"][0]["content"]
@@ -0,0 +1,49 @@
+import logging
+
+
+def make_record(name="bot.feeds", lineno=10, sampled=True):
+    record = logging.LogRecord(name, logging.DEBUG, __file__, lineno, "message %s", ("x",), None)
+    if sampled:
+        record.sampled = True
+    return record
+
+
+def test_sampled_records_pass_one_in_n(bot, monkeypatch):
+    monkeypatch.setattr(bot, "LOG_SAMPLE_EVERY", 4)
+    log_filter = bot.LogContextFilter()
+    passed = [log_filter.filter(make_record()) for _ in range(12)]
+    assert passed == [True, False, False, False] * 3
+
+
+def test_sampling_counts_each_call_site(bot, monkeypatch):
+    monkeypatch.setattr(bot, "LOG_SAMPLE_EVERY", 3)
+    log_filter = bot.LogContextFilter()
+    first = [log_filter.filter(make_record(lineno=10)) for _ in range(3)]
+    second = [log_filter.filter(make_record(lineno=20)) for _ in range(3)]
+    other_logger = [log_filter.filter(make_record(name="bot.llm", lineno=10)) for _ in range(3)]
+    assert first == second == other_logger == [True, False, False]
+
+
+def test_unsampled_records_always_pass(bot, monkeypatch):
+    monkeypatch.setattr(bot, "LOG_SAMPLE_EVERY", 100)
+    log_filter = bot.LogContextFilter()
+    assert all(log_filter.filter(make_record(sampled=False)) for _ in range(5))
+
+
+def test_context_is_attached_from_log_scope(bot):
+    log_filter = bot.LogContextFilter()
+    with bot.log_scope(update_id=7, chat_id=5):
+        with bot.log_scope(link="https://example.com/a"):
+            record = make_record(sampled=False)
+            log_filter.filter(record)
+    assert record.context == {"update_id": 7, "chat_id": 5, "link": "https://example.com/a"}
+    outside = make_record(sampled=False)
+    log_filter.filter(outside)
+    assert outside.context == {}
+
+
+def test_in_log_scope_carries_fields_into_other_threads(bot):
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        context = pool.submit(bot.in_log_scope(bot.log_context.get, link="https://example.com/b")).result()
+    assert context == {"link": "https://example.com/b"}
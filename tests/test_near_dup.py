@@ -0,0 +1,81 @@
+STORY = ("Центробанк повысил ключевую ставку до 21 процента годовых, сообщила пресс-служба регулятора "
+         "после заседания совета директоров в пятницу")
+
+
+def candidate(link, source, text, published=1000):
+    return {"link": link, "guid": link, "source": source, "feed_title": text[:40], "feed_summary": "",
+            "published": published, "text": text, "feed_text": text * 5}
+
+
+def fill(bot, monkeypatch, *candidates):
+    monkeypatch.setattr(bot, "refresh_candidates", lambda: None)
+    bot.candidate_queue.extend(candidates)
+    bot.fill_ready_queue()
+
+
+def test_same_story_from_two_sources_is_summarized_once(bot, openai, monkeypatch):
+    monkeypatch.setattr(bot, "LLM_BATCH_SIZE", 1)
+    monkeypatch.setattr(bot, "READY_QUEUE_DEPTH", 3)
+    fill(bot, monkeypatch,
+         candidate("https://one.example/rate", "one.example", STORY, 1001),
+         candidate("https://two.example/rate", "two.example", STORY + " Москва", 1000))
+    assert [item["link"] for item in bot.ready_queue] == ["https://one.example/rate"]
+    assert len(openai.requests) == 1
+
+
+def test_candidate_similar_to_ready_item_is_skipped(bot, openai, monkeypatch):
+    monkeypatch.setattr(bot, "LLM_BATCH_SIZE", 1)
+    monkeypatch.setattr(bot, "READY_QUEUE_DEPTH", 3)
+    fill(bot, monkeypatch, candidate("https://one.example/rate", "one.example", STORY))
+    fill(bot, monkeypatch, candidate("https://two.example/rate", "two.example", STORY + " Москва"))
+    assert [item["link"] for item in bot.ready_queue] == ["https://one.example/rate"]
+    assert len(openai.requests) == 1
+    # Пост в очереди не считается дублем самого себя
+    assert bot.take_ready_item("-1001", None)["link"] == "https://one.example/rate"
+
+
+def test_discarded_ready_item_releases_story(bot, openai, monkeypatch):
+    monkeypatch.setattr(bot, "LLM_BATCH_SIZE", 1)
+    monkeypatch.setattr(bot, "READY_QUEUE_DEPTH", 3)
+    fill(bot, monkeypatch, candidate("https://one.example/rate", "one.example", STORY))
+    bot.discard_ready_items(list(bot.ready_queue))
+    fill(bot, monkeypatch, candidate("https://two.example/rate", "two.example", STORY + " Москва"))
+    assert [item["link"] for item in bot.ready_queue] == ["https://two.example/rate"]
+    assert len(openai.requests) == 2
+
+
+OTHER = "Сборная по футболу выиграла финал чемпионата в дополнительное время на стадионе в столице"
+
+
+def test_failed_summary_releases_story(bot, openai, monkeypatch):
+    monkeypatch.setattr(bot, "LLM_BATCH_SIZE", 1)
+    monkeypatch.setattr(bot, "READY_QUEUE_DEPTH", 3)
+    summarize = bot.summarize_article
+
+    def flaky(url, *args, **kwargs):
+        if "one.example" in url:
+            raise RuntimeError("страница зависла")
+        return summarize(url, *args, **kwargs)
+
+    monkeypatch.setattr(bot, "summarize_article", flaky)
+    fill(bot, monkeypatch,
+         candidate("https://one.example/rate", "one.example", STORY, 1001),
+         candidate("https://two.example/cup", "two.example", OTHER, 1000))
+    # Второй кандидат готов, история первого не занята в индексе
+    assert [item["link"] for item in bot.ready_queue] == ["https://two.example/cup"]
+    assert bot.near_dup_index.find(bot.near_dup_index.signature(STORY)) is None
+
+
+def test_failed_batch_falls_back_to_single_calls(bot, openai, monkeypatch):
+    monkeypatch.setattr(bot, "LLM_BATCH_SIZE", 3)
+    monkeypatch.setattr(bot, "READY_QUEUE_DEPTH", 3)
+
+    def broken_batch(urls, texts=None):
+        raise RuntimeError("пакет упал")
+
+    monkeypatch.setattr(bot, "summarize_batch", broken_batch)
+    fill(bot, monkeypatch,
+         candidate("https://one.example/rate", "one.example", STORY, 1001),
+         candidate("https://two.example/cup", "two.example", OTHER, 1000))
+    assert sorted(item["link"] for item in bot.ready_queue) == ["https://one.example/rate", "https://two.example/cup"]
+    assert len(openai.single_requests()) == 2
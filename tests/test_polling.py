@@ -0,0 +1,86 @@
+import queue
+from collections import OrderedDict
+
+import pytest
+
+
+class StopPolling(Exception):
+    pass
+
+
+def message(update_id, chat_id=5):
+    return {"update_id": update_id, "message": {"message_id": update_id, "chat": {"id": chat_id},
+                                                "from": {"username": "alice"}, "text": f"/help {update_id}"}}
+
+
+@pytest.fixture
+def polling(bot, telegram, monkeypatch):
+    # Одна очередь без воркеров: тест сам видит, что было принято
+    monkeypatch.setattr(bot, "POLLING_TIMEOUT", 1)
+    monkeypatch.setattr(bot, "UPDATE_WORKERS", 1)
+    monkeypatch.setattr(bot, "update_queues", [queue.Queue(maxsize=100)])
+    monkeypatch.setattr(bot, "seen_update_ids", OrderedDict())
+    return telegram
+
+
+def run_polls(bot, monkeypatch, polls, between=None):
+    # run_polling бесконечен: после polls вызовов getUpdates выходим исключением
+    fetch_updates = bot.fetch_updates
+    calls = []
+
+    def limited(offset):
+        if len(calls) == polls:
+            raise StopPolling()
+        if between and calls:
+            between(len(calls))
+        calls.append(offset)
+        return fetch_updates(offset)
+
+    monkeypatch.setattr(bot, "fetch_updates", limited)
+    with pytest.raises(StopPolling):
+        bot.run_polling()
+    return calls
+
+
+def queued(bot):
+    items = []
+    while not bot.update_queues[0].empty():
+        items.append(bot.update_queues[0].get_nowait()[1]["update_id"])
+    return items
+
+
+def test_polling_sends_limit_and_advances_offset(bot, polling, monkeypatch):
+    polling.updates = [message(10), message(11), message(12)]
+    run_polls(bot, monkeypatch, 2)
+    first, second = polling.sent("getUpdates")
+    assert first["payload"]["offset"] == 0
+    assert first["payload"]["limit"] == bot.POLLING_LIMIT
+    assert first["payload"]["allowed_updates"] == ["message"]
+    assert second["payload"]["offset"] == 13
+    assert queued(bot) == [10, 11, 12]
+    assert bot.db_fetchone("SELECT value FROM config WHERE key = 'update_offset'")[0] == "13"
+    assert polling.sent("deleteWebhook")
+
+
+def test_polling_resumes_from_saved_offset(bot, polling, monkeypatch):
+    polling.updates = [message(10), message(11), message(12)]
+    with bot.db_transaction() as c:
+        c.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('update_offset', '12')")
+    # Перезапуск: настройки перечитываются из базы
+    bot.bot_config.load()
+    run_polls(bot, monkeypatch, 1)
+    assert polling.sent("getUpdates")[0]["payload"]["offset"] == 12
+    assert queued(bot) == [12]
+
+
+def test_full_queue_refetches_batch_without_duplicates(bot, polling, monkeypatch):
+    monkeypatch.setattr(bot, "update_queues", [queue.Queue(maxsize=2)])
+    polling.updates = [message(10), message(11), message(12)]
+    handled = []
+    # Между опросами воркер разбирает очередь
+    offsets = run_polls(bot, monkeypatch, 2, between=lambda _: handled.extend(queued(bot)))
+    handled.extend(queued(bot))
+    # 12 не влез в очередь: offset сдвинут только за принятые, пачка запрошена заново
+    assert offsets == [0, 12]
+    assert handled == [10, 11, 12]
+    assert bot.bot_config.get("update_offset") == "13"
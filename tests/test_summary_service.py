@@ -0,0 +1,81 @@
+import threading
+import time
+
+import pytest
+
+TEXT = "Текст статьи для пересказа без загрузки страницы. " * 10
+
+
+@pytest.fixture
+def delays(bot, monkeypatch):
+    # Задержки, которые summarize_article выбрал перед повтором
+    chosen = []
+    llm_retry_delay = bot.llm_retry_delay
+
+    def recording(error, attempt):
+        chosen.append(llm_retry_delay(error, attempt))
+        return chosen[-1]
+
+    monkeypatch.setattr(bot, "llm_retry_delay", recording)
+    return chosen
+
+
+def test_same_canonical_url_makes_one_request(bot, openai):
+    openai.latency = 0.3
+    service = bot.SummaryService(4, 8)
+    urls = ["https://www.example.com/news/a/?utm_source=rss", "https://example.com/news/a", "http://example.com/news/a#top"]
+    futures = [None] * len(urls)
+
+    def submit(index):
+        futures[index] = service.submit(urls[index], text=TEXT)
+
+    threads = [threading.Thread(target=submit, args=(index,)) for index in range(len(urls))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len({id(future) for future in futures}) == 1
+    assert futures[0].result() == ("Заголовок новости", "Краткий пересказ статьи.")
+    assert len(openai.requests) == 1
+    assert service.in_flight() == 0
+
+
+def test_retry_after_header_is_honoured(bot, openai, delays):
+    openai.fail(times=1, status=429, retry_after=1)
+    started = time.monotonic()
+    assert bot.summarize_article("https://example.com/news/retry", text=TEXT)[0] == "Заголовок новости"
+    assert delays == [1.0]
+    assert time.monotonic() - started >= 0.95
+    assert len(openai.requests) == 2
+
+
+def test_retry_after_ms_takes_precedence(bot, openai, delays):
+    openai.fail(times=1, status=503, retry_after=30, retry_after_ms=200)
+    assert bot.summarize_article("https://example.com/news/retry-ms", text=TEXT)[0] == "Заголовок новости"
+    assert delays == [0.2]
+    assert len(openai.requests) == 2
+
+
+@pytest.mark.parametrize("status", [400, 401, 404])
+def test_client_errors_are_not_retried(bot, openai, delays, status):
+    openai.fail(times=3, status=status)
+    title, _ = bot.summarize_article(f"https://example.com/news/status-{status}", text=TEXT)
+    assert title.startswith("Ошибка")
+    assert len(openai.requests) == 1
+    assert delays == []
+
+
+def test_submit_without_blocking_when_queue_is_full(bot, openai):
+    openai.latency = 0.5
+    service = bot.SummaryService(1, 2)
+    first = service.submit("https://example.com/news/one", block=False, text=TEXT)
+    second = service.submit("https://example.com/news/two", block=False, text=TEXT)
+    assert first and second
+    assert service.submit("https://example.com/news/three", block=False, text=TEXT) is None
+    # Уже идущий запрос той же ссылки место в очереди не занимает
+    assert service.submit("https://example.com/news/one", block=False, text=TEXT) is first
+    first.result()
+    second.result()
+    time.sleep(0.05)
+    third = service.submit("https://example.com/news/three", block=False, text=TEXT)
+    assert third is not None and third.result()[0] == "Заголовок новости"
@@ -0,0 +1,87 @@
+import threading
+import time
+
+
+def test_token_bucket_spaces_reservations(bot):
+    bucket = bot.TokenBucket(rate=10, capacity=1)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[0] == 0
+    for expected, actual in zip((0.1, 0.2, 0.3), waits[1:]):
+        assert abs(actual - expected) < 0.01
+
+
+def test_token_bucket_delay_pushes_next_slot(bot):
+    bucket = bot.TokenBucket(rate=10, capacity=1)
+    bucket.reserve()
+    bucket.delay(1)
+    assert 1.05 < bucket.reserve() < 1.15
+
+
+def test_429_is_retried_after_retry_after(bot, telegram):
+    telegram.fail("sendMessage", times=1, retry_after=1)
+    assert bot.send_message(-1001, "hello")
+    first, second = telegram.sent()
+    assert second["time"] - first["time"] >= 0.95
+    assert second["payload"]["text"] == "hello"
+
+
+def test_429_without_chat_sleeps_and_retries(bot, telegram):
+    telegram.fail("getMe", times=1, retry_after=1)
+    started = time.monotonic()
+    response = bot.telegram_request("getMe")
+    assert response.status_code == 200
+    assert time.monotonic() - started >= 0.95
+    assert len(telegram.sent("getMe")) == 2
+
+
+def test_gives_up_after_max_attempts(bot, telegram, monkeypatch):
+    monkeypatch.setattr(bot, "TELEGRAM_CHAT_RATE", 100)
+    telegram.fail("sendMessage", times=bot.TELEGRAM_MAX_ATTEMPTS, retry_after=0)
+    assert not bot.send_message(-1001, "hello")
+    assert len(telegram.sent()) == bot.TELEGRAM_MAX_ATTEMPTS
+
+
+def test_sends_are_paced_per_chat(bot, telegram, monkeypatch):
+    monkeypatch.setattr(bot, "TELEGRAM_CHAT_RATE", 10)
+    threads = [threading.Thread(target=bot.send_message, args=(chat_id, f"{chat_id}-{n}"))
+               for n in range(5) for chat_id in (-1001, -1002)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    calls = telegram.sent()
+    assert len(calls) == 10
+    for chat_id in (-1001, -1002):
+        times = [call["time"] for call in calls if call["payload"]["chat_id"] == chat_id]
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        assert min(gaps) >= 0.08
+    # Чаты не ждут друг друга: 5 отправок по 0.1 с на чат, а не 10 подряд
+    assert elapsed < 0.8
+
+
+def test_global_bucket_caps_total_rate(bot, telegram, monkeypatch):
+    monkeypatch.setattr(bot, "TELEGRAM_CHAT_RATE", 100)
+    monkeypatch.setattr(bot, "tg_global_bucket", bot.TokenBucket(20, 1))
+    threads = [threading.Thread(target=bot.send_message, args=(chat_id, "x")) for chat_id in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    times = sorted(call["time"] for call in telegram.sent())
+    assert times[-1] - times[0] >= 9 * 0.05 * 0.9
+
+
+def test_concurrent_sends_survive_injected_429(bot, telegram, monkeypatch):
+    monkeypatch.setattr(bot, "TELEGRAM_CHAT_RATE", 5)
+    telegram.fail("sendMessage", times=1, retry_after=1)
+    results = []
+    threads = [threading.Thread(target=lambda chat_id=chat_id: results.append(bot.send_message(chat_id, "x")))
+               for _ in range(5) for chat_id in (-1001, -1002)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [True] * 10
+    assert len(telegram.sent()) == 11